@@ -0,0 +1,47 @@
+from flask import request, jsonify
+import logging
+import safrs
+from database import models
+from logic.system.ai_value_computation import ai_selection_enabled, apply_ai_batch, submit_ai_batch
+
+app_logger = logging.getLogger("api_logic_server_app")
+
+def add_service(app, api, project_dir, swagger_host: str, PORT: str, method_decorators = []):
+    pass
+
+    @app.route('/ai_batch/submit', methods=['POST'])
+    def ai_batch_submit():
+        """
+        Illustrates:
+        * Flush batch-mode (APILOGICSERVER_AI_MODE=batch) supplier selections to the OpenAI Batch API,
+          e.g., at the end of a bulk load.
+
+        Test it with:
+
+                curl -X POST http://localhost:5656/ai_batch/submit
+        """
+        if not ai_selection_enabled():
+            return jsonify({"error": "AI not configured (APILOGICSERVER_CHATGPT_APIKEY)"}), 409
+        batch_id = submit_ai_batch(safrs.DB.session, models.SysSupplierReq)
+        return jsonify({"batch_id": batch_id})
+
+    @app.route('/ai_batch/apply', methods=['POST'])
+    def ai_batch_apply():
+        """
+        Illustrates:
+        * Poll a submitted batch; when complete, apply the AI selections to SysSupplierReq (and commit),
+          repricing their Items with logic.
+
+        Test it with:
+
+                curl -X POST http://localhost:5656/ai_batch/apply?batch_id=batch_abc123
+        """
+        batch_id = request.args.get('batch_id') or (request.get_json(silent=True) or {}).get('batch_id')
+        if not batch_id:
+            return jsonify({"error": "batch_id is required"}), 400
+        if not ai_selection_enabled():
+            return jsonify({"error": "AI not configured (APILOGICSERVER_CHATGPT_APIKEY)"}), 409
+        updated = apply_ai_batch(safrs.DB.session, models.SysSupplierReq, batch_id)
+        if updated is None:
+            return jsonify({"batch_id": batch_id, "status": "in progress"})
+        return jsonify({"batch_id": batch_id, "status": "applied", "updated": [each_row.id for each_row in updated]})
@@ -9,13 +9,36 @@ Uses introspection-based compute_ai_value() utility to:
 - Handle graceful fallback when no API key
 - Store complete audit trail (request, reason, created_on)
 
-This AI handler fires when SysSupplierReq is inserted via Request Pattern.
+This AI handler fires when SysSupplierReq is inserted via Request Pattern
+(see get_supplier_price_from_ai, which callers use to request a supplier price).
+When a flush inserts several Items with suppliers (or SysSupplierReq rows), their
+AI selections are prefetched concurrently (see prefetch_supplier_selections).
 """
 
 from logic_bank.exec_row_logic.logic_row import LogicRow
 from logic_bank.logic_bank import Rule
+from sqlalchemy import event
+from sqlalchemy.orm import selectinload
 from database import models
-from logic.system.ai_value_computation import compute_ai_value
+import os
+from typing import NamedTuple, Optional
+from logic.system.ai_value_computation import ai_prefetch_enabled, ai_selection_enabled, cached_ai_selection, \
+    compute_ai_value, is_row_event_registered, log_row, prefetch_ai_values, register_ai_prefetch
+
+CANDIDATES = 'product.ProductSupplierList'
+OPTIMIZE_FOR = 'fastest reliable delivery while keeping costs reasonable, considering world conditions like supply chain disruptions'
+FALLBACK = 'min:unit_cost'  # Choose cheapest if no API key
+
+
+class SupplierSelection(NamedTuple):
+    """ Parameters of an AI supplier selection - its request row, prefetch and cache lookups must all use the same """
+    candidates: str = CANDIDATES  # relationship path from SysSupplierReq to the candidate rows
+    optimize_for: str = OPTIMIZE_FOR
+    fallback: str = FALLBACK
+    test_context_path: Optional[str] = None  # None: config/ai_test_context.yaml
+
+
+DEFAULT_SELECTION = SupplierSelection()
 
 
 def declare_logic():
@@ -24,11 +47,141 @@ def declare_logic():
     
     Fires on SysSupplierReq insert, uses introspection-based utility
     to automatically discover candidates and compute optimal selection.
+    A selection completed later (batch / background mode) reprices its Item.
+    Declared once, even if this module is also imported by a use case.
     """
+    if is_row_event_registered(models.SysSupplierReq, supplier_id_from_ai):
+        return
     Rule.early_row_event(
         on_class=models.SysSupplierReq,
         calling=supplier_id_from_ai
     )
+    Rule.row_event(
+        on_class=models.SysSupplierReq,
+        calling=item_unit_price_from_request
+    )
+    register_ai_prefetch(preload_supplier_candidates)
+
+
+def preload_supplier_candidates(session, flush_context, instances):
+    """
+    before_flush: load the candidates of all requests pending in this flush, for row logic.
+    
+    Pending requests are inserted Items with suppliers (their SysSupplierReq is created
+    later by row logic), and SysSupplierReq rows inserted directly.
+    The products, their suppliers and supplier regions are loaded in one query each, however many Items
+    (eg, bulk loads) - also in batch / background mode, where the selections are deferred but candidates
+    still serialized.
+    """
+    if not ai_selection_enabled():
+        return  # don't load candidates - rows use the fallback (in SQL)
+    product_ids = {
+        each_instance.product_id for each_instance in session.new
+        if isinstance(each_instance, (models.Item, models.SysSupplierReq)) and each_instance.product_id is not None
+    }
+    if len(product_ids) < 2:
+        return  # one selection - nothing to overlap; row logic loads its candidates in one query
+    with session.no_autoflush:
+        products = session.query(models.Product) \
+            .filter(models.Product.id.in_(product_ids)) \
+            .options(selectinload(models.Product.ProductSupplierList).selectinload(models.ProductSupplier.supplier)) \
+            .all()
+    session.info['ai_candidate_products'] = products  # held for row logic - the identity map is weak
+    release_at_flush_end(session)
+
+
+def prefetch_supplier_selections(session, selection: SupplierSelection):
+    """
+    Run the AI selections of all requests pending in this flush concurrently, when row logic reaches the first.
+    
+    Issued with the selection parameters of the request being processed (not before_flush, where they are
+    not known), so the prefetched prompts match the requests that consume them - once per flush and selection.
+    supplier_id_from_ai then finds each AI response already fetched, so N selections cost ~1 round trip, not N
+    (in N / AI_PREFETCH_BATCH_SIZE batch prompts).
+    """
+    if not ai_prefetch_enabled():
+        return  # no key, or batch / background mode: AI deferred
+    prefetched_selections = session.info.setdefault('ai_prefetched_selections', set())
+    if selection in prefetched_selections:
+        return
+    prefetched_selections.add(selection)
+    release_at_flush_end(session)
+    requests = [
+        pending_request(session, each_new) for each_new in session.new
+        if isinstance(each_new, models.Item) and each_new.product_id is not None
+    ] + [
+        each_new for each_new in session.new
+        if isinstance(each_new, models.SysSupplierReq) and each_new.item is None
+        and getattr(each_new, '_ai_selection', DEFAULT_SELECTION) == selection
+    ]
+    prefetch_ai_values(session, rows=requests, candidates=selection.candidates,
+                       optimize_for=selection.optimize_for, test_context_path=selection.test_context_path)
+
+
+def pending_request(session, item: models.Item) -> models.SysSupplierReq:
+    """ An unsaved SysSupplierReq standing in for item's request: candidates paths navigate from the request row
+    (for the prefetch and cache lookups, as for compute_ai_value) """
+    return models.SysSupplierReq(product_id=item.product_id, product=session.get(models.Product, item.product_id))
+
+
+def release_at_flush_end(session):
+    if not event.contains(session, "after_flush_postexec", release_flush_state):
+        event.listen(session, "after_flush_postexec", release_flush_state)
+        event.listen(session, "after_soft_rollback", release_flush_state)
+
+
+def release_flush_state(session, flush_context_or_transaction):
+    """ after_flush_postexec / after_soft_rollback: row logic is done with the preloaded products and prefetches """
+    session.info.pop('ai_candidate_products', None)
+    session.info.pop('ai_prefetched_selections', None)
+
+
+def get_supplier_price_from_ai(row: models.Item, logic_row: LogicRow,
+                               candidates: str = CANDIDATES,
+                               optimize_for: str = OPTIMIZE_FOR,
+                               fallback: str = FALLBACK,
+                               test_context_path: Optional[str] = None):
+    """
+    Request Pattern: insert a SysSupplierReq for row, return the chosen unit price.
+    
+    The insert fires supplier_id_from_ai, which selects the supplier using
+    the given candidates, optimize_for, fallback and test_context_path (a SupplierSelection) -
+    the same parameters prefetch the selections of the other Items in the flush.
+    
+    With env APILOGICSERVER_AI_AUDIT_CACHED=skip, a decision already made (cached) is returned
+    directly, without inserting (auditing) another SysSupplierReq - independent of APILOGICSERVER_AI_AUDIT=summary,
+    which sets what the SysSupplierReq rows that are inserted record.
+    
+    Args:
+        row: Item needing a unit_price
+        logic_row: LogicBank wrapper for row
+        candidates: relationship path from SysSupplierReq to the candidate rows
+        optimize_for: selection goal passed to the AI
+        fallback: 'first', 'min:<field>' or 'max:<field>' when AI is unavailable
+        test_context_path: world conditions file (None: config/ai_test_context.yaml)
+    
+    Returns:
+        chosen_unit_price of the inserted SysSupplierReq
+    """
+    if os.getenv("APILOGICSERVER_AI_AUDIT_CACHED") == "skip":
+        chosen = cached_ai_selection(row=pending_request(logic_row.session, row), candidates=candidates,
+                                     optimize_for=optimize_for, test_context_path=test_context_path)
+        if chosen is not None and chosen.get('unit_cost') is not None:
+            log_row(logic_row, "Supplier %s from cached AI decision, no SysSupplierReq (cached audit skipped)",
+                    chosen.get('supplier_id'))
+            return chosen['unit_cost']
+    
+    # CRITICAL PATTERN: Pass CLASS to new_logic_row (not instance)
+    supplier_req_logic_row = logic_row.new_logic_row(models.SysSupplierReq)
+    supplier_req = supplier_req_logic_row.row  # Get instance AFTER creation
+    
+    # Set request context (links to Item and Product)
+    supplier_req.item = row  # item_id set on flush (row may be new)
+    supplier_req.product_id = row.product_id
+    supplier_req._ai_selection = SupplierSelection(candidates, optimize_for, fallback, test_context_path)  # transient
+    
+    supplier_req_logic_row.insert(reason="AI supplier selection request")
+    return supplier_req.chosen_unit_price
 
 
 def supplier_id_from_ai(row: models.SysSupplierReq, old_row, logic_row: LogicRow):
@@ -42,8 +195,11 @@ def supplier_id_from_ai(row: models.SysSupplierReq, old_row, logic_row: LogicRow
     - Introspects SysSupplierReq result columns: chosen_supplier_id, chosen_unit_price
     - Maps AI response: chosen_supplier_id ← supplier_id, chosen_unit_price ← unit_cost
     - Loads world_conditions from config/ai_test_context.yaml
+    - Skips AI when there is no decision: one supplier, identical suppliers,
+      or (under normal operations) a supplier both cheapest and fastest
     - Calls OpenAI with structured prompt
     - Handles fallback: min:unit_cost when no API key
+      (the SupplierSelection parameters can be overridden by get_supplier_price_from_ai)
     - Stores complete audit trail
     
     Args:
@@ -55,15 +211,36 @@ def supplier_id_from_ai(row: models.SysSupplierReq, old_row, logic_row: LogicRow
     if not logic_row.is_inserted():
         return
     
-    logic_row.log(f"SysSupplierReq - AI supplier selection starting")
+    selection = getattr(row, '_ai_selection', DEFAULT_SELECTION)
+    prefetch_supplier_selections(logic_row.session, selection)
     
     # Introspection-based AI value computation
     compute_ai_value(
         row=row,
         logic_row=logic_row,
-        candidates='product.ProductSupplierList',
-        optimize_for='fastest reliable delivery while keeping costs reasonable, considering world conditions like supply chain disruptions',
-        fallback='min:unit_cost'  # Choose cheapest if no API key
+        candidates=selection.candidates,
+        optimize_for=selection.optimize_for,
+        fallback=selection.fallback,
+        test_context_path=selection.test_context_path
     )
     
-    logic_row.log(f"SysSupplierReq - AI selection complete: supplier_id={row.chosen_supplier_id}, unit_price={row.chosen_unit_price}")
+    log_row(logic_row, "SysSupplierReq - AI selection complete: supplier_id=%s, unit_price=%s",
+            row.chosen_supplier_id, row.chosen_unit_price)
+
+
+def item_unit_price_from_request(row: models.SysSupplierReq, old_row, logic_row: LogicRow):
+    """
+    A deferred AI selection (batch / background mode) updates its SysSupplierReq after commit:
+    reprice the Item with it, so its amount, the Order total and the Customer balance
+    follow the AI decision - and the credit limit is checked against it.
+    
+    Skipped if the Item has since changed product (it has a newer request).
+    """
+    if not logic_row.is_updated() or row.chosen_unit_price == old_row.chosen_unit_price:
+        return
+    item = row.item
+    if item is None or item.product_id != row.product_id:
+        return
+    item_logic_row = logic_row.user_row_update(row=item, ins_upd_dlt="upd")  # old row copied before the change
+    item.unit_price = row.chosen_unit_price
+    item_logic_row.update(reason="Item - AI selection completed, unit_price from SysSupplierReq")
@@ -17,6 +17,8 @@ Generated: Auto-generated from natural language by GitHub Copilot
 from logic_bank.exec_row_logic.logic_row import LogicRow
 from logic_bank.logic_bank import Rule
 from database import models
+from logic.logic_discovery.ai_requests.supplier_selection import get_supplier_price_from_ai
+from logic.system.ai_value_computation import is_row_event_registered, log_row
 
 
 def declare_logic():
@@ -25,7 +27,10 @@ def declare_logic():
     
     Combines deterministic rules (sums, formulas, constraints) with 
     probabilistic AI value computation (supplier selection).
+    Declared once: a second declaration would double the sums and fire the AI request twice per Item.
     """
+    if is_row_event_registered(models.Item, ItemUnitPriceFromSupplier):
+        return
     
     # =========================================================================
     # Rule 1: Constraint - Customer balance must not exceed credit_limit
@@ -73,61 +78,48 @@ def declare_logic():
     # Rule 5b: Item unit_price - Conditional AI vs. Default
     # =========================================================================
     
-    # Early event handler - fires BEFORE formula to invoke AI if needed
-    Rule.early_row_event(
-        on_class=models.Item,
-        calling=lambda row, old_row, logic_row: ItemUnitPriceFromSupplier(row, logic_row)
-    )
-    
-    # Formula that preserves AI-set value or uses default from Product
+    # Formula calling a function: the function returns the value (AI or Product default)
     Rule.formula(
         derive=models.Item.unit_price,
-        as_expression=lambda row: (
-            row.product.unit_price if row.product.count_suppliers == 0
-            else row.unit_price  # Preserve value set by event handler (AI or None initially)
-        )
+        calling=ItemUnitPriceFromSupplier
     )
 
 
-def ItemUnitPriceFromSupplier(item_row: models.Item, logic_row: LogicRow):
+def ItemUnitPriceFromSupplier(row: models.Item, old_row: models.Item, logic_row: LogicRow):
     """
-    Conditional AI logic: IF product has suppliers THEN use AI ELSE skip.
+    Conditional AI logic: IF product has suppliers THEN use AI ELSE Product.unit_price.
     
     When product has suppliers:
-    1. Creates SysSupplierReq using Request Pattern
+    1. get_supplier_price_from_ai creates SysSupplierReq using Request Pattern
     2. AI handler fires on insert, sets chosen_supplier_id and chosen_unit_price
-    3. Copies AI result back to item_row.unit_price
-    4. Formula (above) preserves this AI-computed value
+    3. Returns chosen_unit_price, which the formula assigns to row.unit_price
     
     When product has no suppliers:
-    - Skips AI, lets formula copy from Product.unit_price
+    - Skips AI, returns Product.unit_price
     
     Args:
-        item_row: The Item being inserted/updated
+        row: The Item being inserted/updated
+        old_row: Prior state of the Item (AI re-selects only if product_id changed)
         logic_row: LogicBank's wrapper with .new_logic_row(), .log() methods
-    """
-    # Only process on insert, skip if no suppliers
-    if not logic_row.is_inserted():
-        return
-    
-    if item_row.product.count_suppliers == 0:
-        logic_row.log(f"Item - Product has no suppliers, using default unit_price")
-        return
-    
-    logic_row.log(f"Item - Product has {item_row.product.count_suppliers} suppliers, invoking AI")
-    
-    # CRITICAL PATTERN: Pass CLASS to new_logic_row (not instance)
-    supplier_req_logic_row = logic_row.new_logic_row(models.SysSupplierReq)
-    supplier_req = supplier_req_logic_row.row  # Get instance AFTER creation
     
-    # Set request context (links to Item and Product)
-    supplier_req.item_id = item_row.id
-    supplier_req.product_id = item_row.product_id
-    
-    # Insert triggers AI handler (see ai_requests/supplier_selection.py)
-    supplier_req_logic_row.insert(reason="AI supplier selection request")
-    
-    # CRITICAL: Copy AI result to target row
-    # (AI populated SysSupplierReq.chosen_unit_price, now copy to Item.unit_price)
-    item_row.unit_price = supplier_req.chosen_unit_price
-    logic_row.log(f"Item - AI selected supplier, unit_price set to {item_row.unit_price}")
+    Returns:
+        unit_price for the Item
+    """
+    # LogicBank reads parent dependencies (row.product.<attr>) from this source, split on whitespace -
+    # so they must not be directly followed by ')' or ',' (eg, as a call argument)
+    count_suppliers = row.product.count_suppliers
+    if count_suppliers == 0:
+        log_row(logic_row, "Item - Product has no suppliers, using default unit_price")
+        return row.product.unit_price
+    
+    # Only select on insert or product change (eg, not quantity edits)
+    if not logic_row.is_inserted() and row.product_id == old_row.product_id:
+        return row.unit_price
+    
+    log_row(logic_row, "Item - Product has %s suppliers, invoking AI", count_suppliers)
+    
+    # Request Pattern: inserts SysSupplierReq, AI handler picks the supplier
+    # (see ai_requests/supplier_selection.py)
+    unit_price = get_supplier_price_from_ai(row=row, logic_row=logic_row)
+    log_row(logic_row, "Item - AI selected supplier, unit_price set to %s", unit_price)
+    return unit_price
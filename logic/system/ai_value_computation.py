@@ -9,6 +9,9 @@ Provides compute_ai_value() function that uses SQLAlchemy introspection to:
 - Handle fallbacks gracefully (no API key, errors)
 - Load test context from YAML
 - Maintain complete audit trail
+- Prefetch AI selections concurrently (AsyncOpenAI) for rows pending in a flush
+- Defer selections to the OpenAI Batch API for non-interactive (bulk) loads
+- Memoize AI responses, so identical selections (same candidates, conditions) skip the network
 
 Convention: Request tables follow SysXxxReq pattern with chosen_* columns.
 Example: SysSupplierReq has chosen_supplier_id, chosen_unit_price
@@ -17,17 +20,186 @@ Example: SysSupplierReq has chosen_supplier_id, chosen_unit_price
 You typically do not alter this file.
 """
 
+import asyncio
+import functools
+import hashlib
 import json
 import os
+import sqlite3
+import threading
+import time
+try:
+    import orjson  # optional - faster (de)serialization of prompts, responses and audit json
+except ImportError:
+    orjson = None
+try:
+    import fastjsonschema  # optional - compiled validator for AI responses
+except ImportError:
+    fastjsonschema = None
+try:
+    from openai import AsyncOpenAI, OpenAI
+except ImportError:
+    AsyncOpenAI = OpenAI = None  # no openai package: selections use the fallback, as with no API key
+try:
+    import yaml
+except ImportError:
+    yaml = None  # only .toml test context files can be read
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
-from typing import Any, List, Dict, Optional
+from typing import Any, Callable, List, Dict, Optional, Tuple
 from pathlib import Path
+from sqlalchemy import event
 from sqlalchemy import inspect as sa_inspect
-from sqlalchemy.orm import ColumnProperty
+from sqlalchemy.orm import ColumnProperty, MANYTOONE, joinedload, with_parent
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm import Session
+from sqlalchemy.orm import object_session as sa_object_session
 from logic_bank.exec_row_logic.logic_row import LogicRow
 import logging
 
 app_logger = logging.getLogger(__name__)
+logic_logger = logging.getLogger('logic_logger')
+
+AI_MODEL = 'gpt-4o-2024-08-06'
+""" Default model (env APILOGICSERVER_AI_MODEL), see _model_for() """
+
+AI_SMALL_MODEL = 'gpt-4o-mini'
+AI_SMALL_MODEL_MAX_CANDIDATES = 8
+""" Selections among at most this many candidates use AI_SMALL_MODEL (env APILOGICSERVER_AI_SMALL_MODEL, empty: off) """
+
+SELECTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "chosen_index": {"type": "integer", "description": "0-based index of the chosen candidate"},
+        "reason": {"type": "string", "description": "Brief explanation, at most 30 words"}
+    },
+    "required": ["chosen_index", "reason"],
+    "additionalProperties": False
+}
+""" Structured output: the model emits only this object (no prose, no missing fields) """
+
+_validate_selection = fastjsonschema.compile(SELECTION_SCHEMA) if fastjsonschema is not None else None
+
+SYSTEM_MESSAGE = {"role": "system", "content": """You are an intelligent selection assistant.
+Analyze the candidate options and select the best one based on the optimization criteria and current conditions.
+Respond with JSON matching this structure: {"chosen_index": <0-based index>, "reason": "<brief explanation, at most 30 words>"}"""}
+
+USER_PROMPT_TEMPLATE = """Current conditions: {world_conditions}
+
+Optimization criteria: {optimize_for}
+
+Candidate options:
+{candidates}
+
+Task: Choose the optimal candidate considering all factors. Respond with the index (0-based) of your chosen candidate and explain your reasoning."""
+
+AI_COMPLETION_PARAMS = {
+    "model": AI_MODEL,
+    "response_format": {
+        "type": "json_schema",
+        "json_schema": {"name": "candidate_selection", "schema": SELECTION_SCHEMA, "strict": True}
+    },
+    "max_tokens": 128,
+    "temperature": 0,
+    "seed": 0
+}
+""" Shared by sync, prefetch (async) and batch requests - short, deterministic (cacheable) responses.
+model is replaced per selection, see _model_for() """
+
+BATCH_SELECTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "selections": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "selection": {"type": "integer", "description": "Selection number, as given in the prompt"},
+                    "chosen_index": SELECTION_SCHEMA["properties"]["chosen_index"],
+                    "reason": SELECTION_SCHEMA["properties"]["reason"]
+                },
+                "required": ["selection", "chosen_index", "reason"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["selections"],
+    "additionalProperties": False
+}
+""" Structured output for a batch prompt: one SELECTION_SCHEMA entry per selection, keyed by number """
+
+BATCH_SYSTEM_MESSAGE = {"role": "system", "content": """You are an intelligent selection assistant.
+For each numbered selection, analyze its candidate options and select the best one based on the optimization criteria and current conditions.
+Respond with JSON matching this structure: {"selections": [{"selection": <number>, "chosen_index": <0-based index within that selection>, "reason": "<brief explanation, at most 30 words>"}]}"""}
+
+BATCH_USER_PROMPT_TEMPLATE = """Current conditions: {world_conditions}
+
+Optimization criteria: {optimize_for}
+
+{selections}
+
+Task: For each selection, choose the optimal candidate considering all factors. Respond with one entry per selection: its number, the index (0-based) of your chosen candidate within that selection, and your reasoning."""
+
+AI_PREFETCH_BATCH_SIZE = 8
+""" selections per prefetch prompt (env APILOGICSERVER_AI_PREFETCH_BATCH overrides, 1 = one prompt per selection) """
+
+BATCH_PENDING = 'Pending AI batch'
+""" reason prefix for request rows awaiting a Batch API result """
+
+BACKGROUND_PENDING = 'Pending AI background'
+""" reason prefix for request rows awaiting a background (after commit) AI selection """
+
+AI_BACKGROUND_MAX_WORKERS = 4
+""" background selection threads (env APILOGICSERVER_AI_BACKGROUND_WORKERS overrides) """
+
+_IDENTITY_SUFFIXES = ('name', 'code', 'part_number')
+""" candidate fields that identify, rather than distinguish, candidates (ignored by _short_circuit) """
+
+_LOWER_IS_BETTER_SUFFIXES = ('_cost', '_price', '_days', '_time')
+
+ONLY_CANDIDATE = (0, "Deterministic short-circuit: only one candidate")
+
+_MISSING = object()
+""" getattr default: tells a missing attribute from one that is None """
+
+_openai_clients: Dict[str, Any] = {}
+""" api_key -> OpenAI client, reused across rows (keep-alive connection pool) """
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+""" relative test_context_path values resolve against this, not the current directory """
+
+DEFAULT_TEST_CONTEXT_PATH = str(PROJECT_ROOT / 'config' / 'ai_test_context.yaml')
+""" config/ai_test_context.yaml relative to project root, computed once """
+
+TEST_CONTEXT_RECHECK_SECONDS = 1.0
+""" how long a loaded test context is used before the file is stat'ed again (edits apply within this) """
+
+_test_context_cache: Dict[str, Tuple[Optional[Tuple[int, int]], str, float]] = {}
+""" test_context_path -> ((mtime_ns, size) or None if missing, world_conditions, checked at), see _load_test_context() """
+
+AI_RESPONSE_CACHE_SIZE = 4096
+
+_ai_response_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+""" LRU memo of AI responses by prompt key - repeated identical selections skip the network """
+
+_decision_dbs: Dict[str, sqlite3.Connection] = {}
+""" path -> connection of the disk decision cache (env APILOGICSERVER_AI_CACHE_DB), see _get_cached_response() """
+
+AI_PREFETCH_MAX_WORKERS = 32
+""" max prefetch requests in flight (thread pool size, async semaphore) - stays under rate limits """
+
+AI_MAX_RETRIES = 3
+""" OpenAI client retries (exponential backoff) on connection errors, 429 and 5xx """
+
+_prefetch_pool: Optional[ThreadPoolExecutor] = None
+""" created on first threaded prefetch, see _select_all_threaded() """
+
+_background_pool: Optional[ThreadPoolExecutor] = None
+""" created on first background selection, see _submit_background() """
+
+_shared_resource_lock = threading.Lock()
+""" guards lazy creation of the shared OpenAI clients, prefetch and background pools, and the response LRU """
 
 
 def compute_ai_value(
@@ -36,7 +208,8 @@ def compute_ai_value(
     candidates: str,
     optimize_for: str,
     fallback: str = 'first',
-    test_context_path: Optional[str] = None
+    test_context_path: Optional[str] = None,
+    mode: Optional[str] = None
 ) -> None:
     """
     Compute AI-selected value from candidate objects using introspection.
@@ -54,6 +227,9 @@ def compute_ai_value(
         optimize_for: Natural language optimization criteria for AI prompt
         fallback: Strategy when no API key ('first', 'min:field_name', 'max:field_name')
         test_context_path: Optional path to ai_test_context.yaml (defaults to config/ai_test_context.yaml)
+        mode: 'sync' (call OpenAI now), 'batch' (apply fallback now, refine via submit_ai_batch()),
+              or 'background' (cached decision now, else apply fallback now and refine in a
+              thread after commit); defaults to env APILOGICSERVER_AI_MODE, else 'sync'
     
     Returns:
         None (modifies row in place, setting chosen_* fields, request, reason, created_on)
@@ -69,51 +245,117 @@ def compute_ai_value(
         # Sets: sys_supplier_req.chosen_supplier_id, chosen_unit_price, request, reason
     """
     
-    logic_row.log(f"AI value computation starting for {row.__class__.__name__}")
+    log_row(logic_row, "AI value computation starting for %s", row.__class__.__name__)
+    
+    # 1. No API key: select the fallback candidate directly - only it is serialized (no N+1)
+    api_key = os.getenv("APILOGICSERVER_CHATGPT_APIKEY")
+    if not api_key or OpenAI is None:
+        log_row(logic_row, "No API key (or openai package) found, using fallback strategy")
+        _apply_fallback_without_ai(row, logic_row, candidates, fallback)
+        return
     
-    # 1. Get candidate objects via relationship path navigation
+    # 2. Get candidate objects via relationship path navigation
     candidate_list = _get_candidates(row, candidates, logic_row)
     if not candidate_list:
-        logic_row.log(f"No candidates found at {candidates}")
+        log_row(logic_row, "No candidates found at %s", candidates)
         row.reason = f"Error: No candidates available at {candidates}"
         return
     
-    logic_row.log(f"Found {len(candidate_list)} candidates")
+    log_row(logic_row, "Found %d candidates", len(candidate_list))
     
-    # 2. Serialize all candidate attributes via introspection
+    # 3. Serialize all candidate attributes via introspection
     # Discovers: supplier_id, supplier_name, unit_cost, lead_time_days, region, etc.
     serialized_candidates = _serialize_candidates(candidate_list, logic_row)
     
-    # 3. Introspect request table to find chosen_* columns
+    # 4. Introspect request table to find chosen_* columns
     # Discovers: chosen_supplier_id, chosen_unit_price from row's columns
     result_columns = _get_result_columns(row)
-    logic_row.log(f"Result columns to populate: {', '.join(result_columns.keys())}")
     
-    # 4. Check for API key
-    api_key = os.getenv("APILOGICSERVER_CHATGPT_APIKEY")
-    
-    if not api_key:
-        logic_row.log("No API key found, using fallback strategy")
-        _apply_fallback(row, serialized_candidates, result_columns, fallback, logic_row)
+    # 5. One candidate: the choice is forced - no test context or AI needed
+    if len(serialized_candidates) == 1:
+        _apply_short_circuit(row, serialized_candidates, result_columns, ONLY_CANDIDATE, logic_row)
         return
     
-    # 5. Load test context from YAML (for demos/testing)
+    # 6. Load test context from YAML (for demos/testing)
     world_conditions = _load_test_context(test_context_path, logic_row)
     
-    # 6. Call OpenAI with structured prompt
+    # 7. No decision for AI to make (identical or dominant candidates)
+    short_circuit = _short_circuit(serialized_candidates, world_conditions)
+    if short_circuit is not None:
+        _apply_short_circuit(row, serialized_candidates, result_columns, short_circuit, logic_row)
+        return
+    
+    # 8. Bulk loads: provisional fallback now, AI decision later via the Batch API
+    ai_mode = _ai_mode(mode)
+    if ai_mode == 'batch':
+        _defer_ai_selection(row, serialized_candidates, result_columns, fallback,
+                            optimize_for, world_conditions, logic_row, BATCH_PENDING)
+        return
+    
+    # 9. Call OpenAI with structured prompt (background: only if already decided)
     try:
-        _call_openai(
+        selected = _call_openai(
             row=row,
             logic_row=logic_row,
             candidates=serialized_candidates,
             result_columns=result_columns,
             optimize_for=optimize_for,
             world_conditions=world_conditions,
-            api_key=api_key
+            api_key=api_key,
+            allow_call=ai_mode != 'background'
         )
     except Exception as e:
-        logic_row.log(f"AI call failed: {str(e)}, using fallback")
+        log_row(logic_row, "AI call failed: %s, using fallback", e)
         _apply_fallback(row, serialized_candidates, result_columns, fallback, logic_row)
+        return
+    
+    # 10. Background: provisional fallback now, AI decision in a thread after commit
+    if not selected:
+        _defer_ai_selection(row, serialized_candidates, result_columns, fallback,
+                            optimize_for, world_conditions, logic_row, BACKGROUND_PENDING)
+        _queue_background(row)
+
+
+def cached_ai_selection(
+    row: Any,
+    candidates: str,
+    optimize_for: str,
+    test_context_path: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    The chosen candidate (serialized) if this selection was already decided (cached), else None.
+    Makes no AI call; a prefetched (new) decision is left for its request row to audit.
+    
+    Lets a caller skip the request row when it need not audit repeated decisions
+    (see get_supplier_price_from_ai, APILOGICSERVER_AI_AUDIT_CACHED=skip).
+    
+    Args:
+        row: Request row (or unsaved stand-in) from which candidates navigates, as for compute_ai_value()
+        candidates, optimize_for, test_context_path: as for compute_ai_value()
+    """
+    if not os.getenv("APILOGICSERVER_CHATGPT_APIKEY") or OpenAI is None or _ai_mode() == 'batch':
+        return None
+    serialized_candidates = _serialize_candidates(_get_candidates(row, candidates, None))
+    if not serialized_candidates:
+        return None
+    world_conditions = _load_test_context(test_context_path)
+    model = _model_for(len(serialized_candidates))
+    prompt_key = _prompt_key(_to_json(serialized_candidates), optimize_for, world_conditions, model)
+    response_data = _get_cached_response(prompt_key, model)
+    if response_data is None or not 0 <= response_data['chosen_index'] < len(serialized_candidates):
+        return None
+    return serialized_candidates[response_data['chosen_index']]
+
+
+def log_row(logic_row: Optional[LogicRow], msg: str, *args: Any) -> None:
+    """
+    logic_row.log(msg % args), only when logic_logger would emit it.
+    
+    logic_row.log() formats the whole row on every call; this skips that
+    (and the message formatting) when info logging is off, e.g., bulk loads.
+    """
+    if logic_row is not None and logic_logger.isEnabledFor(logging.INFO):
+        logic_row.log(msg % args if args else msg)
 
 
 def _get_candidates(row: Any, candidates_path: str, logic_row: LogicRow) -> List[Any]:
@@ -121,17 +363,20 @@ def _get_candidates(row: Any, candidates_path: str, logic_row: LogicRow) -> List
     Navigate relationship path to get candidate objects.
     
     Example: 'product.ProductSupplierList' navigates row.product.ProductSupplierList
+    
+    An unloaded candidate collection is loaded together with the candidates' parents
+    (e.g., ProductSupplier.supplier) in one joined query, instead of lazy loads.
     """
-    parts = candidates_path.split('.')
+    _load_candidates_joined(row, candidates_path)
     current = row
     
-    for part in parts:
-        if not hasattr(current, part):
-            logic_row.log(f"Path navigation failed at '{part}' in {candidates_path}")
+    for part in candidates_path.split('.'):
+        current = getattr(current, part, _MISSING)  # one attribute read per step (hasattr would read it twice)
+        if current is _MISSING:
+            log_row(logic_row, "Path navigation failed at '%s' in %s", part, candidates_path)
             return []
-        current = getattr(current, part)
         if current is None:
-            logic_row.log(f"Null value encountered at '{part}' in {candidates_path}")
+            log_row(logic_row, "Null value encountered at '%s' in %s", part, candidates_path)
             return []
     
     if not isinstance(current, list):
@@ -140,66 +385,213 @@ def _get_candidates(row: Any, candidates_path: str, logic_row: LogicRow) -> List
     return current
 
 
-def _serialize_candidates(candidate_list: List[Any], logic_row: LogicRow) -> List[Dict[str, Any]]:
+def _unloaded_collection(row: Any, candidates_path: str) -> Optional[Tuple[Any, Any, Any]]:
+    """
+    For a candidates_path collection that can be read with a query: (parent, relationship, session).
+    
+    None if a path step is null, or the collection is already loaded, or unflushed candidates may exist
+    (which a query would miss).
+    """
+    *parent_path, collection_key = candidates_path.split('.')
+    parent = row
+    for part in parent_path:
+        parent = getattr(parent, part, None)
+        if parent is None:
+            return None
+    parent_state = sa_inspect(parent)
+    session = sa_object_session(parent)
+    if session is None or not parent_state.persistent or collection_key not in parent_state.unloaded:
+        return None
+    relationship = parent_state.mapper.relationships.get(collection_key)
+    if relationship is None or not relationship.uselist:
+        return None
+    if any(isinstance(each_new, relationship.mapper.class_) for each_new in session.new):
+        return None
+    return parent, relationship, session
+
+
+def _load_candidates_joined(row: Any, candidates_path: str) -> None:
+    """
+    Load an unloaded candidate collection and the candidates' many-to-one parents in one query,
+    and set it as the (loaded) collection.
+    """
+    unloaded = _unloaded_collection(row, candidates_path)
+    if unloaded is None:
+        return
+    parent, relationship, session = unloaded
+    candidate_class = relationship.mapper.class_
+    query = session.query(candidate_class) \
+        .filter(with_parent(parent, getattr(parent.__class__, relationship.key))) \
+        .options(*[
+            joinedload(getattr(candidate_class, each_relationship.key))
+            for each_relationship in relationship.mapper.relationships
+            if each_relationship.direction is MANYTOONE and each_relationship.mapper is not sa_inspect(parent).mapper
+        ])
+    if relationship.order_by:
+        query = query.order_by(*relationship.order_by)
+    with session.no_autoflush:
+        set_committed_value(parent, relationship.key, query.all())
+
+
+def _serialize_candidates(candidate_list: List[Any], logic_row: Optional[LogicRow] = None) -> List[Dict[str, Any]]:
     """
     Serialize candidate objects to JSON-friendly dicts via introspection.
     
     Discovers all scalar columns (id, name, cost, etc.) and related entity attributes.
-    Example output: [{'supplier_id': 1, 'supplier_name': 'Acme', 'unit_cost': 10.5, ...}, ...]
+    Example output: [{'supplier_id': 1, 'supplier_name': 'Acme', 'unit_cost': Decimal('10.5'), ...}, ...]
+    
+    Decimals are kept exact (chosen_unit_price is set from them); _to_json() sends them as floats.
     """
     if not candidate_list:
         return []
     
-    # Introspect first candidate's model to get columns
-    first_candidate = candidate_list[0]
-    mapper = sa_inspect(first_candidate.__class__)
-    
-    # Get scalar columns: id, supplier_id, unit_cost, lead_time_days, etc.
-    scalar_columns = [
-        col.key for col in mapper.column_attrs
-        if isinstance(col, ColumnProperty)
-    ]
+    # Introspect first candidate's model to get columns (once per class)
+    mapper = sa_inspect(candidate_list[0].__class__)
+    scalar_columns, related_attrs = _candidate_fields(candidate_list[0].__class__)
+    parents = _preload_parents(candidate_list, mapper)  # noqa: F841 - keeps parents in identity map
     
     serialized = []
     for candidate in candidate_list:
         candidate_dict = {}
         
-        # Add scalar attributes
+        # Add scalar attributes - loaded values straight from __dict__, getattr (loads) only if expired/deferred
+        loaded = candidate.__dict__
         for col_name in scalar_columns:
-            value = getattr(candidate, col_name, None)
-            # Convert Decimal to float for JSON serialization
-            if isinstance(value, Decimal):
-                value = float(value)
-            candidate_dict[col_name] = value
+            candidate_dict[col_name] = loaded[col_name] if col_name in loaded else getattr(candidate, col_name, None)
         
-        # Add related entity attributes (e.g., supplier.name, supplier.region)
-        for relationship in mapper.relationships:
-            related_obj = getattr(candidate, relationship.key, None)
-            if related_obj and not isinstance(related_obj, list):
-                # Get name and other key attributes from related entity
-                for attr in ['name', 'region', 'code', 'status']:
-                    if hasattr(related_obj, attr):
-                        related_value = getattr(related_obj, attr, None)
-                        candidate_dict[f"{relationship.key}_{attr}"] = related_value
+        # Add related entity attributes
+        for relationship_key, attrs in related_attrs:
+            related_obj = getattr(candidate, relationship_key, None)
+            if related_obj:
+                for attr in attrs:
+                    candidate_dict[f"{relationship_key}_{attr}"] = getattr(related_obj, attr, None)
         
         serialized.append(candidate_dict)
     
-    # Log sample fields for readability
-    if serialized:
-        sample_fields = ', '.join(list(serialized[0].keys())[:5])
-        logic_row.log(f"Serialized candidate fields: {sample_fields}, ...")
-    
     return serialized
 
 
+@functools.lru_cache(maxsize=None)
+def _candidate_fields(candidate_class: type) -> Tuple[List[str], List[Tuple[str, List[str]]]]:
+    """
+    Introspected fields of a candidate class - the model metadata does not change, so per class, not per row.
+    
+    Returns:
+        scalar columns (id, supplier_id, unit_cost, lead_time_days, etc.), and
+        related entity attributes by relationship (e.g., ('supplier', ['name', 'region']))
+    """
+    mapper = sa_inspect(candidate_class)
+    scalar_columns = [
+        col.key for col in mapper.column_attrs
+        if isinstance(col, ColumnProperty)
+    ]
+    # Collections are skipped without loading them
+    related_attrs = [
+        (relationship.key, [attr for attr in ['name', 'region', 'code', 'status']
+                            if hasattr(relationship.mapper.class_, attr)])
+        for relationship in mapper.relationships
+        if not relationship.uselist
+    ]
+    return scalar_columns, related_attrs
+
+
+def _apply_fallback_without_ai(row: Any, logic_row: LogicRow, candidates_path: str, fallback_strategy: str) -> None:
+    """
+    No API key: choose the fallback candidate from the ORM objects (min/max in SQL if not loaded),
+    then serialize, map and audit just that candidate.
+    A lone candidate is audited as the forced choice it is, like the API key path - whether or not it was loaded.
+    """
+    candidate_list = _query_fallback_candidates(row, candidates_path, fallback_strategy)
+    if candidate_list is None:
+        candidate_list = _get_candidates(row, candidates_path, logic_row)
+    if not candidate_list:
+        log_row(logic_row, "No candidates found at %s", candidates_path)
+        row.reason = f"Error: No candidates available at {candidates_path}"
+        return
+    if len(candidate_list) == 1:
+        _apply_short_circuit(row, _serialize_candidates(candidate_list), _get_result_columns(row),
+                             ONLY_CANDIDATE, logic_row)
+        return
+    chosen = _fallback_choice(candidate_list, fallback_strategy, lambda c, field: getattr(c, field, None))
+    _apply_fallback(row, _serialize_candidates([chosen]), _get_result_columns(row), fallback_strategy, logic_row)
+
+
+def _query_fallback_candidates(row: Any, candidates_path: str, fallback_strategy: str) -> Optional[List[Any]]:
+    """
+    Select the 'min:field' / 'max:field' fallback candidate first, with ORDER BY ... LIMIT 2.
+    
+    Example: 'product.ProductSupplierList' with 'min:unit_cost' loads the cheapest ProductSupplier (and one more,
+    so a lone candidate is recognized).  Candidates without a value sort last; ties go to the lowest primary key,
+    so the choice is repeatable (like _fallback_choice(), where the first wins).
+    
+    Returns None (caller uses the in-memory candidates) when the strategy is not min/max,
+    the collection is already loaded, or unflushed candidates may exist.
+    """
+    if not fallback_strategy.startswith(('min:', 'max:')):
+        return None
+    unloaded = _unloaded_collection(row, candidates_path)
+    if unloaded is None:
+        return None
+    parent, relationship, session = unloaded
+    candidate_class = relationship.mapper.class_
+    column = getattr(candidate_class, fallback_strategy.split(':', 1)[1], None)
+    if column is None:
+        return None
+    order_by = column.asc() if fallback_strategy.startswith('min:') else column.desc()
+    with session.no_autoflush:
+        return session.query(candidate_class) \
+            .filter(with_parent(parent, getattr(parent.__class__, relationship.key))) \
+            .order_by(column.is_(None), order_by, *relationship.mapper.primary_key) \
+            .limit(2) \
+            .all()
+
+
+def _preload_parents(candidate_list: List[Any], mapper: Any) -> List[Any]:
+    """
+    Load the (many-to-one) parents of all candidates with one query per relationship.
+    
+    Lazy-loading candidate.supplier one candidate at a time is N+1 queries;
+    once the parents are in the session's identity map, those lazy loads are lookups.
+    
+    Returns the loaded parents - hold them while serializing (the identity map is weak).
+    """
+    loaded = []
+    session = sa_object_session(candidate_list[0])
+    if session is None or len(candidate_list) < 2:
+        return loaded
+    for relationship in mapper.relationships:
+        if relationship.direction is not MANYTOONE or len(relationship.local_columns) != 1:
+            continue
+        parent_pk = relationship.mapper.primary_key
+        if len(parent_pk) != 1:
+            continue
+        fk_attr = mapper.get_property_by_column(next(iter(relationship.local_columns))).key
+        parent_ids = {
+            getattr(candidate, fk_attr) for candidate in candidate_list
+            if relationship.key in sa_inspect(candidate).unloaded
+        }
+        parent_ids.discard(None)
+        if len(parent_ids) > 1:
+            with session.no_autoflush:
+                loaded.extend(session.query(relationship.mapper.class_).filter(parent_pk[0].in_(parent_ids)).all())
+    return loaded
+
+
 def _get_result_columns(row: Any) -> Dict[str, str]:
     """
-    Introspect request table to find chosen_* columns and map to candidate fields.
+    Introspect request table (row or class) to find chosen_* columns and map to candidate fields.
     
     Example: chosen_supplier_id -> supplier_id, chosen_unit_price -> unit_cost/unit_price
     Returns: {'chosen_supplier_id': 'supplier_id', 'chosen_unit_price': 'unit_cost'}
+    (introspected once per class - do not modify)
     """
-    mapper = sa_inspect(row.__class__)
+    return _result_columns_of(row if isinstance(row, type) else row.__class__)
+
+
+@functools.lru_cache(maxsize=None)
+def _result_columns_of(request_class: type) -> Dict[str, str]:
+    """ _get_result_columns() for request_class """
+    mapper = sa_inspect(request_class)
     result_columns = {}
     
     for col in mapper.column_attrs:
@@ -214,31 +606,121 @@ def _get_result_columns(row: Any) -> Dict[str, str]:
     return result_columns
 
 
-def _load_test_context(test_context_path: Optional[str], logic_row: LogicRow) -> str:
+def _load_test_context(test_context_path: Optional[str], logic_row: Optional[LogicRow] = None) -> str:
     """
     Load AI test context from YAML file.
     
-    Defaults to config/ai_test_context.yaml if not specified.
-    Returns 'normal operations' if file not found or no world_conditions set.
+    Defaults to config/ai_test_context.yaml if not specified; a relative path is relative to the project root.
+    Returns 'normal operations' if file not found (including removed since loaded) or no world_conditions set.
+    
+    The file is parsed once and re-read only when its mtime or size changes (not per row) -
+    size catches an edit within the filesystem's mtime granularity.
+    It is stat'ed at most every TEST_CONTEXT_RECHECK_SECONDS, so a bulk load costs no per-row syscalls.
+    A .toml path is parsed with stdlib tomllib (no PyYAML needed).
     """
     if test_context_path is None:
-        # Default path: config/ai_test_context.yaml relative to project root
-        config_dir = Path(__file__).parent.parent.parent / 'config'
-        test_context_path = str(config_dir / 'ai_test_context.yaml')
+        test_context_path = DEFAULT_TEST_CONTEXT_PATH
+    elif not os.path.isabs(test_context_path):
+        test_context_path = str(PROJECT_ROOT / test_context_path)
     
+    now = time.monotonic()
+    cached = _test_context_cache.get(test_context_path)
+    if cached is not None and now - cached[2] < TEST_CONTEXT_RECHECK_SECONDS:
+        return cached[1]
     try:
-        import yaml
-        if Path(test_context_path).exists():
-            with open(test_context_path, 'r') as f:
-                test_context = yaml.safe_load(f)
+        stat = os.stat(test_context_path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        signature = None
+    if cached is not None and cached[0] == signature:
+        _test_context_cache[test_context_path] = (cached[0], cached[1], now)
+        return cached[1]
+    
+    world_conditions = None
+    try:
+        if signature is not None:
+            test_context = _parse_test_context(test_context_path)
+            if test_context:
                 world_conditions = test_context.get('world_conditions')
                 if world_conditions:
-                    logic_row.log(f"Test context loaded: {world_conditions}")
-                    return world_conditions
+                    log_row(logic_row, "Test context loaded: %s", world_conditions)
     except Exception as e:
-        logic_row.log(f"Could not load test context: {e}")
+        app_logger.warning("Could not load test context: %s", e)
+    
+    world_conditions = world_conditions or 'normal operations'
+    _test_context_cache[test_context_path] = (signature, world_conditions, now)
+    return world_conditions
+
+
+def _parse_test_context(test_context_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse the test context file: tomllib for .toml, else PyYAML.
+    
+    YAML uses the LibYAML C loader when PyYAML was built with it (same results as safe_load, faster).
+    """
+    if test_context_path.endswith('.toml'):
+        import tomllib
+        with open(test_context_path, 'rb') as f:
+            return tomllib.load(f)
+    if yaml is None:
+        raise ImportError("PyYAML is required to read a .yaml test context")
+    with open(test_context_path, 'r') as f:
+        return yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+def _short_circuit(candidates: List[Dict[str, Any]], world_conditions: str) -> Optional[Tuple[int, str]]:
+    """
+    Resolve the selection without AI when there is no real decision to make.
     
-    return 'normal operations'
+    - one candidate
+    - all candidates identical on their decision fields (eg, unit_cost, lead_time_days, supplier_region)
+    - under 'normal operations', a candidate no worse on every lower-is-better field
+      (cost, price, days, time) than each other candidate, and strictly better on at least one (Pareto-dominant);
+      candidates tied on all of them (eg, differing only in region) are left to AI
+    
+    Returns:
+        (chosen_index, reason), or None if AI should decide
+    """
+    if len(candidates) == 1:
+        return ONLY_CANDIDATE
+    
+    decision_fields = [
+        field for field in candidates[0]
+        if field != 'id' and not field.endswith('_id') and not field.endswith(_IDENTITY_SUFFIXES)
+    ]
+    if len({tuple(c.get(field) for field in decision_fields) for c in candidates}) == 1:
+        return 0, "Deterministic short-circuit: identical candidates"
+    
+    if world_conditions != 'normal operations':
+        return None
+    numeric_fields = [field for field in decision_fields
+                      if all(isinstance(c.get(field), (int, float, Decimal)) for c in candidates)]
+    if not numeric_fields or not all(field.endswith(_LOWER_IS_BETTER_SUFFIXES) for field in numeric_fields):
+        return None  # direction of "better" unknown
+    # dominant == holds the minimum of every field, and no other candidate ties it on all of them
+    minimums = tuple(min(c[field] for c in candidates) for field in numeric_fields)
+    dominant = [index for index, candidate in enumerate(candidates)
+                if tuple(candidate[field] for field in numeric_fields) == minimums]
+    if len(dominant) != 1:
+        return None  # none, or a tie - decided on the other fields
+    return dominant[0], "Deterministic short-circuit: candidate dominates on " + ", ".join(numeric_fields)
+
+
+def _apply_short_circuit(
+    row: Any,
+    candidates: List[Dict[str, Any]],
+    result_columns: Dict[str, str],
+    short_circuit: Tuple[int, str],
+    logic_row: Optional[LogicRow]
+) -> None:
+    """
+    Apply a _short_circuit() selection (chosen_index, reason), auditing it as deterministic.
+    """
+    chosen_index, reason = short_circuit
+    log_row(logic_row, reason)
+    _map_result_fields(row, candidates[chosen_index], result_columns, logic_row)
+    row.reason = reason
+    row.request = _to_json({**_audited_candidates(candidates), 'strategy': 'deterministic'})
 
 
 def _apply_fallback(
@@ -264,25 +746,40 @@ def _apply_fallback(
     if fallback_strategy == 'first':
         chosen = candidates[0]
         reason = f"Fallback: No API key. Selected first candidate"
-    elif fallback_strategy.startswith('min:'):
-        field = fallback_strategy.split(':', 1)[1]
-        chosen = min(candidates, key=lambda c: c.get(field, float('inf')))
-        reason = f"Fallback: No API key. Selected minimum {field} ({chosen.get(field)})"
-    elif fallback_strategy.startswith('max:'):
+    elif fallback_strategy.startswith(('min:', 'max:')):
         field = fallback_strategy.split(':', 1)[1]
-        chosen = max(candidates, key=lambda c: c.get(field, float('-inf')))
-        reason = f"Fallback: No API key. Selected maximum {field} ({chosen.get(field)})"
+        chosen = _fallback_choice(candidates, fallback_strategy, lambda c, field: c.get(field))
+        extreme = 'minimum' if fallback_strategy.startswith('min:') else 'maximum'
+        reason = f"Fallback: No API key. Selected {extreme} {field} ({chosen.get(field)})"
     else:
         chosen = candidates[0]
         reason = f"Fallback: Unknown strategy '{fallback_strategy}', used first"
     
-    logic_row.log(reason)
+    log_row(logic_row, reason)
     
     # Map chosen candidate fields to result columns
     _map_result_fields(row, chosen, result_columns, logic_row)
     
     row.reason = reason
-    row.request = json.dumps({'candidates': candidates, 'strategy': fallback_strategy}, indent=2)
+    row.request = _to_json({**_audited_candidates(candidates), 'strategy': fallback_strategy})
+
+
+def _fallback_choice(candidates: List[Any], fallback_strategy: str, get_value: Callable[[Any, str], Any]) -> Any:
+    """
+    The 'min:field' / 'max:field' candidate in one pass (first wins ties), else the first candidate.
+    
+    Candidates without a value for field are skipped; get_value reads a dict or an ORM object.
+    """
+    if not fallback_strategy.startswith(('min:', 'max:')):
+        return candidates[0]
+    field = fallback_strategy.split(':', 1)[1]
+    is_max = fallback_strategy.startswith('max:')
+    chosen, chosen_value = candidates[0], None
+    for candidate in candidates:
+        value = get_value(candidate, field)
+        if value is not None and (chosen_value is None or (value > chosen_value if is_max else value < chosen_value)):
+            chosen, chosen_value = candidate, value
+    return chosen
 
 
 def _call_openai(
@@ -292,79 +789,878 @@ def _call_openai(
     result_columns: Dict[str, str],
     optimize_for: str,
     world_conditions: str,
-    api_key: str
-) -> None:
+    api_key: str,
+    allow_call: bool = True
+) -> bool:
     """
     Call OpenAI API to select optimal candidate based on criteria.
     
     Constructs structured prompt with candidates and optimization criteria.
     Parses JSON response and maps chosen fields to result columns.
+    Raises ValueError for a malformed response or invalid index (caller applies fallback).
+    
+    Returns:
+        True if selected; False (row unchanged) if not prefetched or cached and not allow_call
     """
-    from openai import OpenAI
-    client = OpenAI(api_key=api_key)
+    candidates_json = _to_json(candidates)  # serialized once: cache key and audit
+    model = _model_for(len(candidates))
+    prompt_key = _prompt_key(candidates_json, optimize_for, world_conditions, model)
+    session = sa_object_session(row)
+    response_data = session.info.get('ai_prefetched_responses', {}).pop(prompt_key, None) if session is not None else None
+    cached_response = None if response_data is not None else _get_cached_response(prompt_key, model)
     
-    # Construct system message
-    system_message = """You are an intelligent selection assistant.
-Analyze the candidate options and select the best one based on the optimization criteria and current conditions.
-Respond with JSON matching this structure: {"chosen_index": <0-based index>, "reason": "<explanation>"}"""
+    if response_data is not None:
+        log_row(logic_row, "Using prefetched OpenAI selection")
+    elif cached_response is not None:
+        response_data = dict(cached_response, reason=f"cached: {cached_response['reason']}")
+        log_row(logic_row, "Using cached OpenAI selection (same candidates and conditions)")
+    elif not allow_call:
+        return False
+    else:
+        client = _get_openai_client(api_key)
+        
+        log_row(logic_row, "Calling OpenAI API (%s) for selection", model)
+        
+        messages = _build_messages(candidates, optimize_for, world_conditions)
+        completion = client.chat.completions.create(messages=messages, **dict(AI_COMPLETION_PARAMS, model=model),
+                                                    **_cache_routing(optimize_for, world_conditions, model))
+        
+        response_text = _completion_text(completion)
+        response_data = _parse_selection(response_text)
+    
+    chosen_index = response_data['chosen_index']
+    ai_reason = response_data['reason']
+    if not 0 <= chosen_index < len(candidates):
+        raise ValueError(f"AI chose invalid index {chosen_index}")  # caller applies fallback
+    
+    if cached_response is None:
+        _cache_response(prompt_key, response_data, model)
+    
+    chosen = candidates[chosen_index]
+    
+    log_row(logic_row, "AI selected candidate %d: %.100s", chosen_index, ai_reason)
     
-    # Construct user context
-    user_context = f"""Current conditions: {world_conditions}
+    # Map chosen candidate fields to result columns
+    _map_result_fields(row, chosen, result_columns, logic_row)
+    
+    row.reason = ai_reason
+    audited_candidates = f'"candidates":{candidates_json}' if not _audit_summary() else \
+        f'"candidate_count":{len(candidates)}'
+    # same json as _to_json({...}), reusing the serialized candidates
+    row.request = (f'{{"world_conditions":{_to_json(world_conditions)},{audited_candidates},'
+                   f'"optimize_for":{_to_json(optimize_for)},"model":{_to_json(model)}}}')
+    return True
 
-Candidate options:
-{json.dumps(candidates, indent=2)}
 
-Optimization criteria: {optimize_for}
+def _audit_summary() -> bool:
+    """
+    True with env APILOGICSERVER_AI_AUDIT=summary: row.request records the candidate count, not the candidates
+    (the chosen candidate is in the chosen_* columns) - a much smaller audit row for wide candidate lists.
+    
+    Deferred (batch / background) requests always keep their candidates - the prompt is rebuilt from them.
+    """
+    return os.getenv("APILOGICSERVER_AI_AUDIT") == "summary"
 
-Task: Choose the optimal candidate considering all factors. Respond with the index (0-based) of your chosen candidate and explain your reasoning."""
+
+def _audited_candidates(candidates: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """ The candidates entry of row.request json, see _audit_summary() """
+    if _audit_summary():
+        return {'candidate_count': len(candidates)}
+    return {'candidates': candidates}
+
+
+def _get_cached_response(prompt_key: str, model: str) -> Optional[Dict[str, Any]]:
+    """
+    Cached AI response for prompt_key: from the in-process LRU, else the disk decision cache.
+    
+    The disk cache (sqlite, opt-in via env APILOGICSERVER_AI_CACHE_DB=<path>) survives restarts,
+    so warm starts skip the API for selections already made; entries are per model.
+    """
+    with _shared_resource_lock:  # prefetch threads and background selections share the LRU
+        cached_response = _ai_response_cache.get(prompt_key)
+        if cached_response is not None:
+            _ai_response_cache.move_to_end(prompt_key)
+            return cached_response
+    decision_db = _get_decision_db()
+    if decision_db is None:
+        return None
+    try:
+        with _shared_resource_lock:
+            found = decision_db.execute("SELECT response FROM ai_decision WHERE key = ? AND model = ?",
+                                        (prompt_key, model)).fetchone()
+    except sqlite3.Error as e:
+        app_logger.warning("AI decision cache read failed: %s", e)
+        return None
+    if found is None:
+        return None
+    cached_response = _from_json(found[0])
+    _remember_response(prompt_key, cached_response)
+    return cached_response
+
+
+def _cache_response(prompt_key: str, response_data: Dict[str, Any], model: str) -> None:
+    """ Cache a validated AI response in the LRU, and in the disk decision cache if enabled """
+    _remember_response(prompt_key, response_data)
+    decision_db = _get_decision_db()
+    if decision_db is None:
+        return
+    try:
+        with _shared_resource_lock:
+            decision_db.execute("INSERT OR REPLACE INTO ai_decision (key, model, response) VALUES (?, ?, ?)",
+                                (prompt_key, model, _to_json(response_data)))
+    except sqlite3.Error as e:
+        app_logger.warning("AI decision cache write failed: %s", e)
+
+
+def _remember_response(prompt_key: str, response_data: Dict[str, Any]) -> None:
+    """ Add to the in-process LRU, evicting the least recently used entry when full (caller must not hold the lock) """
+    with _shared_resource_lock:
+        _ai_response_cache[prompt_key] = response_data
+        if len(_ai_response_cache) > AI_RESPONSE_CACHE_SIZE:
+            _ai_response_cache.popitem(last=False)
+
+
+def _get_decision_db() -> Optional[sqlite3.Connection]:
+    """
+    Connection to the disk decision cache at env APILOGICSERVER_AI_CACHE_DB, or None if not set.
+    
+    WAL journal: several server processes can share the file; each write is its own (autocommit) transaction.
+    """
+    path = os.getenv("APILOGICSERVER_AI_CACHE_DB")
+    if not path:
+        return None
+    decision_db = _decision_dbs.get(path)
+    if decision_db is None:
+        with _shared_resource_lock:
+            decision_db = _decision_dbs.get(path)
+            if decision_db is None:
+                try:
+                    decision_db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+                    decision_db.execute("PRAGMA journal_mode=WAL")
+                    decision_db.execute("CREATE TABLE IF NOT EXISTS ai_decision "
+                                        "(key TEXT NOT NULL, model TEXT NOT NULL, response TEXT NOT NULL, "
+                                        "created_on TEXT DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (key, model))")
+                except sqlite3.Error as e:
+                    app_logger.warning("AI decision cache unavailable at %s: %s", path, e)
+                    return None
+                _decision_dbs[path] = decision_db
+    return decision_db
+
+
+def _get_openai_client(api_key: str) -> Any:
+    """
+    Return the shared OpenAI client for api_key, creating it on first use.
+    
+    Constructing a client per row allocates a new connection pool (TLS handshake, DNS);
+    reusing one keeps connections alive across calls.  The client is thread-safe;
+    creation is locked so concurrent requests (threaded server) share one.
+    """
+    client = _openai_clients.get(api_key)
+    if client is None:
+        with _shared_resource_lock:
+            client = _openai_clients.get(api_key)
+            if client is None:
+                client = OpenAI(api_key=api_key, max_retries=AI_MAX_RETRIES)
+                _openai_clients[api_key] = client
+    return client
+
+
+def _to_json(value: Any) -> str:
+    """
+    Serialize compactly with orjson if installed, else stdlib json.
+    
+    Compact, not indent=2: prompts are billed per token and row.request is an audit column
+    read by tools, not people (~half the size either way).
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=_json_default).decode()
+    return json.dumps(value, default=_json_default, separators=(',', ':'))
+
+
+def _json_default(value: Any) -> Any:
+    """ Decimal (eg, unit_cost) as a json number """
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _from_json(text: Any) -> Any:
+    """ Parse with orjson if installed, else stdlib json """
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def _completion_text(completion: Any) -> str:
+    """
+    The response json of a chat completion.
+    
+    With strict structured outputs, content always matches the schema - unless the model refuses,
+    in which case content is None and message.refusal explains; raise ValueError so the row falls back.
+    """
+    message = completion.choices[0].message
+    if not message.content:
+        raise ValueError(f"AI refused: {getattr(message, 'refusal', None)}")
+    return message.content
+
+
+def _parse_selection(response_text: str) -> Dict[str, Any]:
+    """
+    Parse and validate an AI selection response against SELECTION_SCHEMA.
+    
+    Raises ValueError if malformed, so the caller falls back instead of guessing.
+    Uses a fastjsonschema validator (compiled once) if installed.
+    """
+    return _check_selection(_from_json(response_text))
+
+
+def _check_selection(response_data: Any) -> Dict[str, Any]:
+    """ Validate a parsed selection against SELECTION_SCHEMA, raising ValueError if it does not match """
+    if _validate_selection is not None:
+        return _validate_selection(response_data)
+    if not isinstance(response_data, dict) or \
+            type(response_data.get('chosen_index')) is not int or \
+            not isinstance(response_data.get('reason'), str):
+        raise ValueError(f"AI response does not match selection schema: {str(response_data)[:200]}")
+    return response_data
+
+
+def _parse_batch_selection(response_text: str, count: int) -> List[Optional[Dict[str, Any]]]:
+    """
+    Split a batch prompt response into per-selection responses (see BATCH_SELECTION_SCHEMA).
+    
+    Returns count entries, in selection order; an entry is None if the model omitted
+    or garbled that selection (its row then calls OpenAI itself).
+    Raises ValueError if the response is not a selections list at all.
+    """
+    response_data = _from_json(response_text)
+    selections = response_data.get('selections') if isinstance(response_data, dict) else None
+    if not isinstance(selections, list):
+        raise ValueError(f"AI response does not match batch selection schema: {response_text[:200]}")
+    results: List[Optional[Dict[str, Any]]] = [None] * count
+    for each_selection in selections:
+        number = each_selection.get('selection') if isinstance(each_selection, dict) else None
+        if type(number) is not int or not 1 <= number <= count or results[number - 1] is not None:
+            continue
+        try:
+            results[number - 1] = _check_selection({
+                'chosen_index': each_selection.get('chosen_index'),
+                'reason': each_selection.get('reason')
+            })
+        except ValueError:
+            pass
+    return results
+
+
+def _ai_mode(mode: Optional[str] = None) -> str:
+    """ 'sync', 'batch' or 'background' - explicit mode, else env APILOGICSERVER_AI_MODE """
+    return mode or os.getenv("APILOGICSERVER_AI_MODE", "sync")
+
+
+def _defer_ai_selection(
+    row: Any,
+    candidates: List[Dict[str, Any]],
+    result_columns: Dict[str, str],
+    fallback_strategy: str,
+    optimize_for: str,
+    world_conditions: str,
+    logic_row: LogicRow,
+    pending: str
+) -> None:
+    """
+    Batch / background mode: select provisionally by fallback, and mark the row pending
+    (BATCH_PENDING for submit_ai_batch(), BACKGROUND_PENDING for _complete_in_background()).
+    
+    The request json keeps everything needed to rebuild the prompt later.
+    """
+    _apply_fallback(row, candidates, result_columns, fallback_strategy, logic_row)
+    row.reason = f"{pending} (provisional: {fallback_strategy})"
+    row.request = _to_json({
+        'world_conditions': world_conditions,
+        'candidates': candidates,
+        'optimize_for': optimize_for,
+        'model': _model_for(len(candidates))
+    })
+    log_row(logic_row, "AI selection deferred: %s", pending)
+
+
+def _queue_background(row: Any) -> None:
+    """
+    Hold row for a background AI selection, started when its transaction commits.
     
-    messages = [
-        {"role": "system", "content": system_message},
-        {"role": "user", "content": user_context}
+    The row's id is known after flush; a rollback discards it.
+    """
+    session = sa_object_session(row)
+    if session is None:
+        return
+    session.info.setdefault('ai_background_rows', []).append(row)
+    if not event.contains(session, "after_flush_postexec", _collect_background):
+        event.listen(session, "after_flush_postexec", _collect_background)
+        event.listen(session, "after_commit", _submit_background)
+        event.listen(session, "after_soft_rollback", _discard_background)
+
+
+def _collect_background(session: Any, flush_context: Any) -> None:
+    """ after_flush_postexec: (class, id, request, bind) of the flushed background rows """
+    rows = session.info.pop('ai_background_rows', [])
+    flushed = session.info.setdefault('ai_background_flushed', [])
+    for each_row in rows:
+        if each_row.id is not None:
+            flushed.append((each_row.__class__, each_row.id, each_row.request,
+                            session.get_bind(mapper=sa_inspect(each_row.__class__))))
+
+
+def _discard_background(session: Any, previous_transaction: Any) -> None:
+    """ after_soft_rollback: rolled-back rows get no background selection """
+    session.info.pop('ai_background_rows', None)
+    session.info.pop('ai_background_flushed', None)
+
+
+def _submit_background(session: Any) -> None:
+    """ after_commit: start the background AI selections of the committed rows """
+    global _background_pool
+    flushed = session.info.pop('ai_background_flushed', None)
+    if not flushed:
+        return
+    if _background_pool is None:
+        with _shared_resource_lock:
+            if _background_pool is None:
+                workers = int(os.getenv("APILOGICSERVER_AI_BACKGROUND_WORKERS", AI_BACKGROUND_MAX_WORKERS))
+                _background_pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='ai_background')
+    api_key = os.getenv("APILOGICSERVER_CHATGPT_APIKEY")
+    for request_class, row_id, request, bind in flushed:
+        _background_pool.submit(_complete_in_background, request_class, row_id, request, bind, api_key)
+
+
+def _complete_in_background(request_class: Any, row_id: Any, request: str, bind: Any, api_key: str) -> None:
+    """
+    Select with AI and update the committed request row, in its own logic-enabled session.
+    
+    The update runs the declared rules, so logic that uses the selection (eg, an Item price from
+    its SysSupplierReq) is re-derived and re-checked by its constraints.
+    On failure, or if a constraint rejects the selection, the row keeps its provisional (fallback) selection,
+    with the reason noting why.
+    The row is left alone if it is no longer pending (e.g., changed meanwhile).
+    """
+    chosen = None
+    try:
+        request_data = _from_json(request)
+        candidates = request_data['candidates']
+        model = request_data.get('model', AI_MODEL)
+        prompt_key = _prompt_key(_to_json(candidates), request_data['optimize_for'], request_data['world_conditions'],
+                                 model)
+        response_data = _get_cached_response(prompt_key, model)
+        if response_data is None:
+            messages = _build_messages(candidates, request_data['optimize_for'], request_data['world_conditions'])
+            completion = _get_openai_client(api_key).chat.completions.create(
+                messages=messages, **dict(AI_COMPLETION_PARAMS, model=model),
+                **_cache_routing(request_data['optimize_for'], request_data['world_conditions'], model))
+            response_data = _parse_selection(_completion_text(completion))
+        if not 0 <= response_data['chosen_index'] < len(candidates):
+            raise ValueError(f"AI chose invalid index {response_data['chosen_index']}")
+        _cache_response(prompt_key, response_data, model)
+        chosen = candidates[response_data['chosen_index']]
+        reason = response_data['reason']
+    except Exception as e:
+        reason = f"AI background selection failed ({e}): kept provisional fallback selection"
+    try:
+        with _logic_session(bind) as session:
+            row = session.get(request_class, row_id)
+            if row is None or not (row.reason or '').startswith(BACKGROUND_PENDING):
+                return
+            if chosen is not None:
+                _map_result_fields(row, chosen, _get_result_columns(request_class), None)
+            row.reason = reason
+            try:
+                session.commit()
+            except Exception as e:  # eg, a constraint on the logic using the selection
+                session.rollback()
+                reason = f"AI background selection rejected ({e}): kept provisional fallback selection"
+                session.get(request_class, row_id).reason = reason
+                session.commit()
+        app_logger.debug("AI background selection %s %s: %s", request_class.__name__, row_id, reason)
+    except Exception as e:
+        app_logger.warning("AI background selection %s %s not saved: %s", request_class.__name__, row_id, e)
+
+
+def _logic_session(bind: Any) -> Session:
+    """
+    A new session whose flushes run the declared LogicBank rules, like the session that inserted the request rows.
+    
+    For selections completed outside the request's transaction (see _complete_in_background()).
+    """
+    from logic_bank.exec_trans_logic.listeners import after_flush, before_commit, before_flush
+    session = Session(bind=bind)
+    event.listen(session, "before_flush", before_flush)
+    event.listen(session, "before_commit", before_commit)
+    event.listen(session, "after_flush", after_flush)
+    return session
+
+
+def submit_ai_batch(session: Any, request_class: Any) -> Optional[str]:
+    """
+    Submit all pending batch-mode request rows to the OpenAI Batch API (~50% cost, 24h window).
+    
+    Call after the rows are committed (custom_id is the row id), e.g., at the end of a bulk load.
+    Rows are marked with the batch id; poll with apply_ai_batch().
+    
+    Returns:
+        batch id, or None if nothing pending / no API key
+    """
+    api_key = os.getenv("APILOGICSERVER_CHATGPT_APIKEY")
+    pending = session.query(request_class).filter(request_class.reason.startswith(f"{BATCH_PENDING} (")).all()
+    if not api_key or not pending:
+        return None
+    
+    lines = []
+    for each_row in pending:
+        request = _from_json(each_row.request)
+        lines.append(_to_json({
+            "custom_id": str(each_row.id),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": dict(
+                AI_COMPLETION_PARAMS,
+                model=request.get('model', AI_MODEL),
+                messages=_build_messages(request['candidates'], request['optimize_for'], request['world_conditions'])
+            )
+        }))
+    
+    client = _get_openai_client(api_key)
+    batch_file = client.files.create(file=("ai_batch.jsonl", "\n".join(lines).encode()), purpose="batch")
+    batch = client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions",
+                                  completion_window="24h")
+    for each_row in pending:
+        each_row.reason = f"{BATCH_PENDING} {batch.id}"
+    session.commit()
+    app_logger.info("AI batch %s submitted: %d requests", batch.id, len(pending))
+    return batch.id
+
+
+def apply_ai_batch(session: Any, request_class: Any, batch_id: str) -> Optional[List[Any]]:
+    """
+    Poll a submitted batch; when complete, set the AI selection on its request rows.
+    
+    Pass a logic-enabled session (eg, safrs.DB.session): each row's update runs the declared rules,
+    so logic that uses the selection (eg, an Item price from its SysSupplierReq) is re-derived and re-checked.
+    Rows are committed one at a time - a row whose selection a constraint rejects keeps its
+    provisional (fallback) values, as do rows of a failed batch or an errored line.
+    
+    Returns:
+        the updated request rows, or None if the batch is not yet complete / no API key
+    """
+    api_key = os.getenv("APILOGICSERVER_CHATGPT_APIKEY")
+    if not api_key or OpenAI is None:
+        return None  # cannot poll - rows keep their provisional selection
+    client = _get_openai_client(api_key)
+    batch = client.batches.retrieve(batch_id)
+    if batch.status not in ('completed', 'failed', 'expired', 'cancelled'):
+        return None
+    
+    rows = session.query(request_class).filter(request_class.reason == f"{BATCH_PENDING} {batch_id}").all()
+    rows_by_id = {str(each_row.id): each_row for each_row in rows}
+    result_columns = _get_result_columns(request_class) if rows else {}
+    updated = []
+    if batch.status == 'completed' and batch.output_file_id:
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            result = _from_json(line)
+            each_row = rows_by_id.get(result.get('custom_id'))
+            response = result.get('response') or {}
+            if each_row is None or response.get('status_code') != 200:
+                continue
+            candidates = _from_json(each_row.request)['candidates']
+            try:
+                message = response['body']['choices'][0]['message']
+                if not message.get('content'):
+                    raise ValueError(f"AI refused: {message.get('refusal')}")
+                response_data = _parse_selection(message['content'])
+            except ValueError:
+                continue  # malformed or refused - keep provisional selection
+            chosen_index = response_data['chosen_index']
+            if not 0 <= chosen_index < len(candidates):
+                continue  # invalid index - keep provisional selection
+            _map_result_fields(each_row, candidates[chosen_index], result_columns, None)
+            each_row.reason = response_data['reason']
+            del rows_by_id[result['custom_id']]
+            try:
+                session.commit()
+                updated.append(each_row)
+            except Exception as e:  # eg, a constraint on the logic using the selection
+                session.rollback()
+                each_row.reason = f"AI batch {batch_id} selection rejected ({e}): kept provisional fallback selection"
+                session.commit()
+    for each_row in rows_by_id.values():  # not answered - keep provisional selection
+        each_row.reason = f"AI batch {batch_id} {batch.status}: kept provisional fallback selection"
+    session.commit()
+    app_logger.info("AI batch %s %s: %d requests updated", batch_id, batch.status, len(updated))
+    return updated
+
+
+def _build_messages(
+    candidates: List[Dict[str, Any]],
+    optimize_for: str,
+    world_conditions: str
+) -> List[Dict[str, str]]:
+    """
+    Construct the chat messages for a selection; shared by the sync, prefetch and batch paths.
+    
+    Only the user message varies; the system message is a module constant.
+    """
+    return [
+        SYSTEM_MESSAGE,
+        {"role": "user", "content": USER_PROMPT_TEMPLATE.format(
+            world_conditions=world_conditions,
+            candidates=_to_json(_prompt_candidates(candidates)),
+            optimize_for=optimize_for
+        )}
     ]
+
+
+def _prompt_candidates(candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Candidates as sent to the model: without fields that cannot inform the choice.
     
-    logic_row.log("Calling OpenAI API for selection")
+    Drops the candidate's own id and *_id fields shared by all candidates (eg, product_id);
+    row.request keeps the full candidates for audit.  With compact json, this roughly halves prompt tokens.
+    """
+    shared_ids = {
+        field for field in candidates[0]
+        if field.endswith('_id') and all(c.get(field) == candidates[0][field] for c in candidates)
+    }
+    return [
+        {field: value for field, value in c.items() if field != 'id' and field not in shared_ids}
+        for c in candidates
+    ]
+
+
+def _build_batch_messages(
+    candidate_lists: List[List[Dict[str, Any]]],
+    optimize_for: str,
+    world_conditions: str
+) -> List[Dict[str, str]]:
+    """
+    Construct one prompt for several selections, numbered from 1 (see BATCH_SELECTION_SCHEMA).
     
-    completion = client.chat.completions.create(
-        model='gpt-4o-2024-08-06',
-        messages=messages,
-        response_format={"type": "json_object"},
-        temperature=0.7
+    Conditions and criteria are stated once, not per selection.
+    """
+    selections = "\n\n".join(
+        f"Selection {number}:\n{_to_json(_prompt_candidates(candidates))}"
+        for number, candidates in enumerate(candidate_lists, start=1)
     )
+    return [
+        BATCH_SYSTEM_MESSAGE,
+        {"role": "user", "content": BATCH_USER_PROMPT_TEMPLATE.format(
+            world_conditions=world_conditions,
+            selections=selections,
+            optimize_for=optimize_for
+        )}
+    ]
+
+
+def _batch_completion_params(count: int, model: str) -> Dict[str, Any]:
+    """ AI_COMPLETION_PARAMS for a batch prompt of count selections """
+    return dict(
+        AI_COMPLETION_PARAMS,
+        model=model,
+        response_format={
+            "type": "json_schema",
+            "json_schema": {"name": "candidate_selections", "schema": BATCH_SELECTION_SCHEMA, "strict": True}
+        },
+        max_tokens=AI_COMPLETION_PARAMS["max_tokens"] * count
+    )
+
+
+def _cache_routing(optimize_for: str, world_conditions: str, model: str) -> Dict[str, Any]:
+    """
+    Request option routing prompts with the same prefix (system message, conditions, criteria)
+    to the same OpenAI prompt cache, so long prompts (e.g., batch prompts) reuse the cached prefix.
     
-    response_text = completion.choices[0].message.content
-    response_data = json.loads(response_text)
+    Sent as extra_body: prompt_cache_key is not a keyword argument in older SDKs.
+    """
+    prefix = hashlib.blake2b(f"{world_conditions}\0{optimize_for}".encode(), digest_size=8).hexdigest()
+    return {"extra_body": {"prompt_cache_key": f"{model}:{prefix}"}}
+
+
+def _model_for(candidate_count: int) -> str:
+    """
+    Model for a selection among candidate_count candidates: AI_SMALL_MODEL for short lists
+    (cheaper and faster, ample for comparing a few suppliers), else AI_MODEL.
+    Both can be set by env (APILOGICSERVER_AI_SMALL_MODEL, APILOGICSERVER_AI_MODEL);
+    an explicit APILOGICSERVER_AI_MODEL is used for every selection, unless a small model is set explicitly too.
+    """
+    model = os.getenv("APILOGICSERVER_AI_MODEL")
+    small_model = os.getenv("APILOGICSERVER_AI_SMALL_MODEL", None if model else AI_SMALL_MODEL)
+    if small_model and candidate_count <= AI_SMALL_MODEL_MAX_CANDIDATES:
+        return small_model
+    return model or AI_MODEL
+
+
+def _prompt_key(candidates_json: str, optimize_for: str, world_conditions: str, model: str) -> str:
+    """
+    Key identifying a selection: content hash of world conditions, every candidate's fields
+    (as _to_json(candidates)), the optimization criteria and the model - everything the response depends on.
     
-    chosen_index = response_data.get('chosen_index', 0)
-    ai_reason = response_data.get('reason', 'No reason provided')
+    Used to match prefetched responses to their row, and to memoize responses -
+    a change in conditions or supplier data yields a new key.
+    Hashes the compact candidates json, so a cache hit does not build the prompt;
+    blake2b is faster than sha256, and 16 bytes ample for a 4096-entry cache.
+    """
+    key = hashlib.blake2b(digest_size=16)
+    for part in (model, world_conditions, optimize_for, candidates_json):
+        key.update(part.encode())
+        key.update(b'\0')
+    return key.hexdigest()
+
+
+def prefetch_ai_values(
+    session: Session,
+    rows: List[Any],
+    candidates: str,
+    optimize_for: str,
+    test_context_path: Optional[str] = None
+) -> None:
+    """
+    Run the AI selections for several request rows ahead of their row logic, in a few concurrent batch prompts.
     
-    # Validate index
-    if chosen_index < 0 or chosen_index >= len(candidates):
-        logic_row.log(f"AI chose invalid index {chosen_index}, using first candidate")
-        chosen_index = 0
-        ai_reason = f"AI selection invalid (index {chosen_index}), defaulted to first. Original reason: {ai_reason}"
+    Each selection is network-bound, so when a flush inserts many request rows
+    the blocking per-row calls serialize (N x latency).  This groups the selections into
+    batch prompts of AI_PREFETCH_BATCH_SIZE (N / b calls), and issues those all at once
+    with AsyncOpenAI + asyncio.gather (~1 x latency); compute_ai_value() then
+    finds its response already available, instead of calling OpenAI.
+    If called where an event loop is already running, a thread pool is used instead.
+    Selections missing from batch responses are retried in one more concurrent round of single prompts.
+    Responses are held in session.info until the flush ends (or rolls back).
     
-    chosen = candidates[chosen_index]
+    Args:
+        session: The flushing session (the request rows' session)
+        rows: The pending request rows (or unsaved stand-ins), from which candidates navigates
+        candidates, optimize_for, test_context_path: Must match those passed to compute_ai_value()
+    """
+    api_key = os.getenv("APILOGICSERVER_CHATGPT_APIKEY")
+    if not ai_prefetch_enabled() or len(rows) < 2:
+        return  # nothing to overlap - per-row path is as fast
     
-    logic_row.log(f"AI selected candidate {chosen_index}: {ai_reason[:100]}")
+    world_conditions = _load_test_context(test_context_path)
+    prefetched = _prefetched_responses(session)
+    pending = {}  # prompt key -> serialized candidates
+    for each_row in rows:
+        serialized_candidates = _serialize_candidates(_get_candidates(each_row, candidates, None))
+        if not serialized_candidates or _short_circuit(serialized_candidates, world_conditions) is not None:
+            continue  # resolved without AI
+        model = _model_for(len(serialized_candidates))
+        key = _prompt_key(_to_json(serialized_candidates), optimize_for, world_conditions, model)
+        if key not in prefetched and _get_cached_response(key, model) is None:
+            pending[key] = serialized_candidates
+    if len(pending) < 2:
+        return
     
-    # Map chosen candidate fields to result columns
-    _map_result_fields(row, chosen, result_columns, logic_row)
+    batch_size = max(1, int(os.getenv("APILOGICSERVER_AI_PREFETCH_BATCH", AI_PREFETCH_BATCH_SIZE)))
+    missing = _prefetch_round(list(pending.keys()), pending, prefetched, batch_size, optimize_for, world_conditions, api_key)
+    if missing:  # omitted from a batch response: retry together, rather than one row at a time
+        _prefetch_round(missing, pending, prefetched, 1, optimize_for, world_conditions, api_key)
+
+
+def _prefetched_responses(session: Session) -> Dict[str, Dict[str, Any]]:
+    """
+    AI responses obtained by prefetch_ai_values(), keyed by prompt; consumed by _call_openai().
     
-    row.reason = ai_reason
-    row.request = json.dumps({
-        'world_conditions': world_conditions,
-        'candidates': candidates,
-        'optimize_for': optimize_for,
-        'model': 'gpt-4o-2024-08-06'
-    }, indent=2)
+    Held per session, and discarded when its flush ends - a flush that fails after the prefetch
+    (eg, a constraint rollback) does not leave them behind.
+    """
+    if not event.contains(session, "after_flush_postexec", _discard_prefetched):
+        event.listen(session, "after_flush_postexec", _discard_prefetched)
+        event.listen(session, "after_soft_rollback", _discard_prefetched)
+    return session.info.setdefault('ai_prefetched_responses', {})
+
+
+def _discard_prefetched(session: Any, flush_context_or_transaction: Any) -> None:
+    """ after_flush_postexec / after_soft_rollback: prefetched responses not used by row logic """
+    session.info.pop('ai_prefetched_responses', None)
+
+
+def _prefetch_round(
+    keys: List[str],
+    pending: Dict[str, List[Dict[str, Any]]],
+    prefetched: Dict[str, Dict[str, Any]],
+    batch_size: int,
+    optimize_for: str,
+    world_conditions: str,
+    api_key: str
+) -> List[str]:
+    """
+    Issue the selections for keys concurrently, batch_size per prompt; store responses in prefetched.
+    
+    Returns the keys a batch prompt's response omitted or garbled (single prompts are not retried -
+    the client already retries failed calls).
+    """
+    keys_by_model = {}  # a batch prompt goes to one model
+    for key in keys:
+        keys_by_model.setdefault(_model_for(len(pending[key])), []).append(key)
+    batches, requests = [], []
+    for model, model_keys in keys_by_model.items():
+        routing = _cache_routing(optimize_for, world_conditions, model)
+        for start in range(0, len(model_keys), batch_size):
+            batch = model_keys[start:start + batch_size]
+            batches.append(batch)
+            if len(batch) == 1:
+                requests.append((_build_messages(pending[batch[0]], optimize_for, world_conditions),
+                                 dict(AI_COMPLETION_PARAMS, model=model, **routing)))
+            else:
+                requests.append((_build_batch_messages([pending[key] for key in batch], optimize_for, world_conditions),
+                                 dict(_batch_completion_params(len(batch), model), **routing)))
+    
+    try:
+        if _event_loop_running():  # asyncio.run() not allowed - blocking calls on threads instead
+            responses = _select_all_threaded(requests, api_key)
+        else:
+            responses = asyncio.run(_select_all_async(requests, api_key))
+    except Exception as e:
+        app_logger.warning("AI prefetch failed: %s, using per-row calls", e)
+        return []
+    
+    missing = []
+    for batch, response_text in zip(batches, responses):
+        batch_responses = [None] * len(batch)
+        if not isinstance(response_text, Exception):
+            try:
+                if len(batch) == 1:
+                    batch_responses = [_parse_selection(response_text)]
+                else:
+                    batch_responses = _parse_batch_selection(response_text, len(batch))
+            except ValueError as e:
+                app_logger.debug("AI prefetch response discarded: %s", e)
+        for key, response in zip(batch, batch_responses):
+            if response is not None:
+                prefetched[key] = response
+            elif len(batch) > 1:
+                missing.append(key)
+    app_logger.debug("AI prefetch: %d selections in %d concurrent prompts, %d missing",
+                     len(keys), len(batches), len(missing))
+    return missing
+
+
+def ai_prefetch_enabled() -> bool:
+    """
+    True if prefetch_ai_values() would call OpenAI (API key set, openai installed, sync mode).
+    
+    Lets a prefetch listener skip loading candidates that would not be used.
+    """
+    return ai_selection_enabled() and _ai_mode() == 'sync'
+
+
+def ai_selection_enabled() -> bool:
+    """
+    True if compute_ai_value() selects with AI (API key set, openai installed), in any mode -
+    so it serializes every candidate, rather than only the fallback's.
+    """
+    return bool(os.getenv("APILOGICSERVER_CHATGPT_APIKEY")) and OpenAI is not None
+
+
+def _event_loop_running() -> bool:
+    """ True when called from within an event loop (e.g., an async server), where asyncio.run() fails """
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def _select_all_threaded(requests: List[Tuple[List[Dict[str, str]], Dict[str, Any]]], api_key: str) -> List[Any]:
+    """
+    Issue all (messages, params) requests concurrently as blocking calls on a thread pool, sharing the sync client.
+    
+    Returns response texts; failed calls are returned as exceptions (rows fall back to sync call).
+    """
+    global _prefetch_pool
+    if _prefetch_pool is None:
+        with _shared_resource_lock:
+            if _prefetch_pool is None:
+                _prefetch_pool = ThreadPoolExecutor(max_workers=AI_PREFETCH_MAX_WORKERS,
+                                                    thread_name_prefix='ai_prefetch')
+    client = _get_openai_client(api_key)
+    futures = [
+        _prefetch_pool.submit(client.chat.completions.create, messages=messages, **params)
+        for messages, params in requests
+    ]
+    responses = []
+    for future in futures:
+        try:
+            responses.append(_completion_text(future.result()))
+        except Exception as e:
+            responses.append(e)
+    return responses
+
+
+async def _select_all_async(requests: List[Tuple[List[Dict[str, str]], Dict[str, Any]]], api_key: str) -> List[Any]:
+    """
+    Issue all (messages, params) requests concurrently on one AsyncOpenAI client (shared connection pool).
+    
+    The async client is not cached like _get_openai_client(): its connections are bound
+    to the event loop, and asyncio.run() creates a new loop per prefetch.
+    
+    Returns response texts; failed calls are returned as exceptions (rows fall back to sync call).
+    """
+    semaphore = asyncio.Semaphore(AI_PREFETCH_MAX_WORKERS)
+    async with AsyncOpenAI(api_key=api_key, max_retries=AI_MAX_RETRIES) as client:
+        return await asyncio.gather(
+            *[_select_async(client, semaphore, messages, params) for messages, params in requests],
+            return_exceptions=True
+        )
+
+
+async def _select_async(client: Any, semaphore: asyncio.Semaphore,
+                        messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+    """
+    Await one request; a single selection is the same request as the sync path in _call_openai().
+    """
+    async with semaphore:
+        completion = await client.chat.completions.create(messages=messages, **params)
+    return _completion_text(completion)
+
+
+def is_row_event_registered(on_class: Any, calling: Callable) -> bool:
+    """
+    True if a row event (or formula) calling a function of this name is already declared for on_class.
+    
+    Matches by module-qualified name, not identity: a logic file loaded both by auto-discovery
+    and by import is two module objects, and would otherwise register (and fire) its AI rule twice.
+    A match is logged, so a skipped duplicate declaration is visible in the startup log.
+    """
+    from logic_bank.rule_bank.rule_bank import RuleBank
+    table_rules = RuleBank().orm_objects.get(on_class.__name__)
+    if table_rules is None:
+        return False
+    for each_rule in table_rules.rules:
+        function = getattr(each_rule, '_function', None)
+        if function is not None and function.__qualname__ == calling.__qualname__ and \
+                function.__module__.split('.')[-1] == calling.__module__.split('.')[-1]:
+            app_logger.info("Logic for %s already declared (%s.%s) - duplicate declaration skipped",
+                            on_class.__name__, function.__module__, function.__qualname__)
+            return True
+    return False
+
+
+def register_ai_prefetch(listener: Callable[[Any, Any, Any], None]) -> None:
+    """
+    Register listener(session, flush_context, instances) to run before LogicBank's row logic.
+    
+    LogicBank registers its before_flush listener on activation (before declare_logic runs),
+    so the listener is inserted ahead of it.
+    """
+    from logic_bank.rule_bank.rule_bank import RuleBank
+    session = RuleBank()._session
+    if session is None:
+        app_logger.debug("AI prefetch not registered: LogicBank session not set")
+        return
+    if not event.contains(session, "before_flush", listener):
+        event.listen(session, "before_flush", listener, insert=True)
 
 
 def _map_result_fields(
     row: Any,
     chosen: Dict[str, Any],
     result_columns: Dict[str, str],
-    logic_row: LogicRow
+    logic_row: Optional[LogicRow]
 ) -> None:
     """
     Map chosen candidate fields to request table result columns.
@@ -374,28 +1670,50 @@ def _map_result_fields(
     - chosen_supplier_id maps to supplier_id
     
     Example: chosen_supplier_id=1, chosen_unit_price=10.5 from supplier_id, unit_cost
+    Logged as one line (logic_row.log formats the whole row per call), not one per column.
     """
-    for result_col, target_field in result_columns.items():
-        value = None
-        
-        # Direct match
-        if target_field in chosen:
-            value = chosen[target_field]
-        # Try variations: unit_price -> unit_cost
-        elif target_field.replace('_price', '_cost') in chosen:
-            value = chosen[target_field.replace('_price', '_cost')]
-        elif target_field.replace('_cost', '_price') in chosen:
-            value = chosen[target_field.replace('_cost', '_price')]
+    mapped = []
+    for result_col, source_field, kind in _result_field_sources(tuple(result_columns.items()), tuple(chosen)):
+        value = chosen[source_field] if source_field is not None else None
         
         if value is not None:
             # Convert to Decimal for price/cost fields, keep integers as integers for ID fields
-            if isinstance(value, (int, float)):
-                if '_id' in result_col or result_col.endswith('_id'):
+            if isinstance(value, (int, float, Decimal)):
+                if kind == 'id':
                     value = int(value)  # Keep ID fields as integers
-                elif '_price' in result_col or '_cost' in result_col or '_amount' in result_col:
-                    value = Decimal(str(value))  # Convert monetary fields to Decimal
+                elif kind == 'money' and not isinstance(value, Decimal):  # Decimal: exact value from the candidate row
+                    value = Decimal(str(value))  # Convert monetary fields (from json) to Decimal
                 # else: keep as-is for other numeric fields
             setattr(row, result_col, value)
-            logic_row.log(f"Set {result_col} = {value}")
+            mapped.append((result_col, value))
+        else:
+            log_row(logic_row, "Warning: Could not map %s to %s", result_columns[result_col], result_col)
+    if mapped and logic_row is not None and logic_logger.isEnabledFor(logging.INFO):
+        log_row(logic_row, "Set %s", ", ".join(f"{result_col} = {value}" for result_col, value in mapped))
+
+
+@functools.lru_cache(maxsize=256)
+def _result_field_sources(
+    result_columns: Tuple[Tuple[str, str], ...],
+    candidate_fields: Tuple[str, ...]
+) -> List[Tuple[str, Optional[str], str]]:
+    """
+    Resolve, once per (request columns, candidate fields), where each result column comes from.
+    
+    Returns (result_col, candidate field or None, kind), kind: 'id', 'money' or 'other'.
+    Naming variations: target unit_price is found as unit_price, else unit_cost (and vice versa).
+    """
+    sources = []
+    for result_col, target_field in result_columns:
+        source_field = next((field for field in (target_field,
+                                                 target_field.replace('_price', '_cost'),
+                                                 target_field.replace('_cost', '_price'))
+                             if field in candidate_fields), None)
+        if '_id' in result_col:
+            kind = 'id'
+        elif '_price' in result_col or '_cost' in result_col or '_amount' in result_col:
+            kind = 'money'
         else:
-            logic_row.log(f"Warning: Could not map {target_field} to {result_col}")
+            kind = 'other'
+        sources.append((result_col, source_field, kind))
+    return sources
@@ -1,6 +1,8 @@
 
 Feature: Probabilistic ranking married with deterministic policy
 
+  # pseudo steps: the demo Supplier has no embargo, and Order no fulfillment_mode
+  @skip
   Scenario: Embargo filters a high-scoring supplier
     Given supplier S1 is embargoed and supplier S2 is not
     And rank_suppliers for Product P returns [S1(score=0.92), S2(score=0.90)]
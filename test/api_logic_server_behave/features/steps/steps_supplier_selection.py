@@ -0,0 +1,422 @@
+"""
+Supplier selection logic (check_credit + ai_requests/supplier_selection), run on a scratch copy of database/db.sqlite.
+
+Where AI is used, FakeOpenAI stands in for the OpenAI client: it chooses the first candidate, and counts its prompts
+(or misbehaves, per FakeOpenAI.behaviour).
+"""
+import functools
+import json
+import os
+import shutil
+import tempfile
+import time
+import types
+from pathlib import Path
+
+from behave import given, when, then
+from logic_bank.logic_bank import LogicBank
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import models
+import logic.system.ai_value_computation as ai_value_computation
+
+project_root = Path(__file__).resolve().parents[4]
+
+
+def set_env(ctx, name, value):
+    """ set (or unset, if value is None) an environment variable for this scenario """
+    prior = os.environ.get(name)
+    ctx.add_cleanup(lambda: os.environ.pop(name, None) if prior is None else os.environ.update({name: prior}))
+    if value is None:
+        os.environ.pop(name, None)
+    else:
+        os.environ[name] = value
+
+
+def activate_supplier_selection(ctx, declarations=1):
+    """ scratch copy of the database, LogicBank activated with the supplier selection logic declared n times """
+    ctx.scratch = tempfile.mkdtemp()
+    ctx.add_cleanup(shutil.rmtree, ctx.scratch, True)
+    db_path = os.path.join(ctx.scratch, 'db.sqlite')
+    shutil.copy(project_root / 'database' / 'db.sqlite', db_path)
+    engine = create_engine(f'sqlite:///{db_path}')
+    ctx.add_cleanup(engine.dispose)
+    ctx.session = sessionmaker(bind=engine)()
+    ctx.add_cleanup(ctx.session.close)
+    ai_value_computation._ai_response_cache.clear()
+    ai_value_computation._openai_clients.clear()
+    for name in ('APILOGICSERVER_AI_MODE', 'APILOGICSERVER_AI_AUDIT', 'APILOGICSERVER_AI_AUDIT_CACHED',
+                 'APILOGICSERVER_AI_CACHE_DB', 'APILOGICSERVER_AI_MODEL', 'APILOGICSERVER_AI_SMALL_MODEL',
+                 'APILOGICSERVER_AI_PREFETCH_BATCH'):
+        set_env(ctx, name, None)
+
+    def activator():
+        from logic.logic_discovery import check_credit
+        from logic.logic_discovery.ai_requests import supplier_selection
+        for each_declaration in range(declarations):
+            check_credit.declare_logic()
+            supplier_selection.declare_logic()
+    LogicBank.activate(session=ctx.session, activator=activator)
+    ctx.prior_requests = ctx.session.query(models.SysSupplierReq).count()
+
+
+class FakeOpenAI:
+    """ OpenAI stand-in: always chooses the first candidate, and records (model, selections) per prompt """
+
+    calls = []
+    prefetched_calls = 0  # calls made with the async client
+    batch_input = None  # jsonl of the submitted Batch API file
+    behaviour = None  # 'omit last selection', 'refuse' or 'invalid index'
+
+    def __init__(self, *args, **kwargs):
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+        self.files = types.SimpleNamespace(create=self.create_file, content=self.file_content)
+        self.batches = types.SimpleNamespace(create=lambda **kwargs: types.SimpleNamespace(id='batch_1'),
+                                             retrieve=lambda batch_id: types.SimpleNamespace(
+                                                 status='completed', output_file_id='file_out'))
+
+    @staticmethod
+    def answer(params):
+        if params['response_format']['json_schema']['name'] == 'candidate_selections':
+            count = params['messages'][-1]['content'].count('Selection ')
+            FakeOpenAI.calls.append((params['model'], count))
+            answered = count - 1 if FakeOpenAI.behaviour == 'omit last selection' else count
+            return json.dumps({"selections": [{"selection": i, "chosen_index": 0, "reason": "fake: first candidate"}
+                                              for i in range(1, answered + 1)]})
+        FakeOpenAI.calls.append((params['model'], 1))
+        chosen_index = 99 if FakeOpenAI.behaviour == 'invalid index' else 0
+        return json.dumps({"chosen_index": chosen_index, "reason": "fake: first candidate"})
+
+    def create(self, **params):
+        content = self.answer(params)
+        if FakeOpenAI.behaviour == 'refuse':
+            message = types.SimpleNamespace(content=None, parsed=None, refusal="fake: refused")
+        else:
+            message = types.SimpleNamespace(content=content, parsed=None, refusal=None)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+    def create_file(self, file, purpose):
+        FakeOpenAI.batch_input = file[1].decode()
+        return types.SimpleNamespace(id='file_in')
+
+    def file_content(self, file_id):
+        lines = []
+        for each_line in FakeOpenAI.batch_input.splitlines():
+            request = json.loads(each_line)
+            body = {"choices": [{"message": {"content": self.answer(request['body'])}}]}
+            lines.append(json.dumps({"custom_id": request['custom_id'],
+                                     "response": {"status_code": 200, "body": body}}))
+        return types.SimpleNamespace(text="\n".join(lines))
+
+
+class FakeAsyncOpenAI(FakeOpenAI):
+
+    async def create(self, **params):
+        FakeOpenAI.prefetched_calls += 1
+        return FakeOpenAI.create(self, **params)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+@given("the demo database with supplier selection logic")
+def step_impl(ctx):
+    activate_supplier_selection(ctx)
+
+
+@given("no OpenAI API key")
+def step_impl(ctx):
+    set_env(ctx, 'APILOGICSERVER_CHATGPT_APIKEY', None)
+
+
+def use_fake_openai(ctx, behaviour=None):
+    set_env(ctx, 'APILOGICSERVER_CHATGPT_APIKEY', 'fake-key')
+    FakeOpenAI.calls, FakeOpenAI.prefetched_calls, FakeOpenAI.batch_input = [], 0, None
+    FakeOpenAI.behaviour = behaviour
+    ctx.add_cleanup(setattr, FakeOpenAI, 'behaviour', None)
+    for name, fake in (('OpenAI', FakeOpenAI), ('AsyncOpenAI', FakeAsyncOpenAI)):
+        ctx.add_cleanup(setattr, ai_value_computation, name, getattr(ai_value_computation, name))
+        setattr(ai_value_computation, name, fake)
+    ctx.add_cleanup(ai_value_computation._openai_clients.clear)
+
+
+@given("a fake OpenAI client that chooses the first candidate")
+def step_impl(ctx):
+    use_fake_openai(ctx)
+
+
+@given("a fake OpenAI client that omits the last selection of each batch prompt")
+def step_impl(ctx):
+    use_fake_openai(ctx, 'omit last selection')
+
+
+@given("a fake OpenAI client that refuses to choose")
+def step_impl(ctx):
+    use_fake_openai(ctx, 'refuse')
+
+
+@given("a fake OpenAI client that chooses an index out of range")
+def step_impl(ctx):
+    use_fake_openai(ctx, 'invalid index')
+
+
+def override_supplier_selection(ctx, **overrides):
+    """ check_credit requests selections with these get_supplier_price_from_ai arguments overridden """
+    from logic.logic_discovery import check_credit
+    original = check_credit.get_supplier_price_from_ai
+    ctx.add_cleanup(setattr, check_credit, 'get_supplier_price_from_ai', original)
+    check_credit.get_supplier_price_from_ai = functools.partial(original, **overrides)
+
+
+@given('supplier selection optimized for "{optimize_for}"')
+def step_impl(ctx, optimize_for):
+    override_supplier_selection(ctx, optimize_for=optimize_for)
+
+
+def write_test_context(ctx, file_name, world_conditions):
+    path = os.path.join(ctx.scratch, file_name)
+    with open(path, 'w') as f:
+        if file_name.endswith('.toml'):
+            f.write(f'world_conditions = "{world_conditions}"\n')
+        else:
+            f.write(f"world_conditions: '{world_conditions}'\n")
+    return path
+
+
+@given('a test context file "{file_name}" with world conditions "{world_conditions}"')
+def step_impl(ctx, file_name, world_conditions):
+    """ selections read their world conditions from this file (in the scratch directory) """
+    ctx.test_context_path = write_test_context(ctx, file_name, world_conditions)
+    ctx.add_cleanup(ai_value_computation._test_context_cache.pop, ctx.test_context_path, None)
+    override_supplier_selection(ctx, test_context_path=ctx.test_context_path)
+
+
+@given('a test context file "{file_name}" with world conditions "{world_conditions}", '
+       'given by its path relative to the project root')
+def step_impl(ctx, file_name, world_conditions):
+    """ behave runs in test/api_logic_server_behave, so the path only resolves against the project root """
+    path = write_test_context(ctx, file_name, world_conditions)
+    ctx.add_cleanup(ai_value_computation._test_context_cache.pop, path, None)
+    override_supplier_selection(ctx, test_context_path=os.path.relpath(path, project_root))
+
+
+def add_product_supplier(ctx, supplier_id, product_id, unit_cost, lead_time_days=3):
+    ctx.session.add(models.ProductSupplier(product_id=product_id, supplier_id=supplier_id,
+                                           supplier_part_number=f'P{product_id}-S{supplier_id}',
+                                           unit_cost=unit_cost, lead_time_days=lead_time_days))
+    ctx.session.commit()
+
+
+@given("supplier {supplier_id:d} is added for product {product_id:d} at unit cost {unit_cost:d}")
+def step_impl(ctx, supplier_id, product_id, unit_cost):
+    add_product_supplier(ctx, supplier_id, product_id, unit_cost)
+
+
+@given("supplier {supplier_id:d} is added for product {product_id:d} at unit cost {unit_cost:d} "
+       "and lead time {lead_time_days:d} days")
+def step_impl(ctx, supplier_id, product_id, unit_cost, lead_time_days):
+    add_product_supplier(ctx, supplier_id, product_id, unit_cost, lead_time_days)
+
+
+@when('an order is placed with items "{items}"')
+def step_impl(ctx, items):
+    """ items: product_id:quantity, ... """
+    order = models.Order(customer_id=1, notes='supplier selection')
+    ctx.session.add(order)
+    for each_item in items.split(','):
+        product_id, quantity = each_item.split(':')
+        order.ItemList.append(models.Item(product_id=int(product_id), quantity=int(quantity)))
+    ctx.session.commit()
+    ctx.order_id = order.id
+
+
+def order_item(ctx, product_id):
+    return ctx.session.query(models.Item).filter_by(order_id=ctx.order_id, product_id=product_id).one()
+
+
+def supplier_request(ctx, product_id):
+    """ the latest SysSupplierReq for product_id """
+    ctx.session.expire_all()
+    return ctx.session.query(models.SysSupplierReq).filter_by(product_id=product_id) \
+        .order_by(models.SysSupplierReq.id.desc()).first()
+
+
+@then("the product {product_id:d} item should have unit price {unit_price:d}")
+def step_impl(ctx, product_id, unit_price):
+    item = order_item(ctx, product_id)
+    assert item.unit_price == unit_price, item.unit_price
+
+
+@then("the order total should be {amount_total:d}")
+def step_impl(ctx, amount_total):
+    order = ctx.session.get(models.Order, ctx.order_id)
+    assert order.amount_total == amount_total, order.amount_total
+
+
+@then("there should be {count:d} new supplier requests")
+def step_impl(ctx, count):
+    new_requests = ctx.session.query(models.SysSupplierReq).count() - ctx.prior_requests
+    assert new_requests == count, new_requests
+
+
+@then('the product {product_id:d} supplier request should have unit price {unit_price:d} and reason "{reason}"')
+def step_impl(ctx, product_id, unit_price, reason):
+    request = supplier_request(ctx, product_id)
+    assert request.chosen_unit_price == unit_price, request.chosen_unit_price
+    assert request.reason.startswith(reason), request.reason
+
+
+@then("OpenAI should have been called {count:d} times")
+def step_impl(ctx, count):
+    assert len(FakeOpenAI.calls) == count, FakeOpenAI.calls
+
+
+@then("the last OpenAI call should select for {count:d} products")
+def step_impl(ctx, count):
+    assert FakeOpenAI.calls[-1][1] == count, FakeOpenAI.calls
+
+
+@when("product {product_id:d} is renamed")
+def step_impl(ctx, product_id):
+    product = ctx.session.get(models.Product, product_id)
+    product.name = product.name + ' (renamed)'
+    ctx.session.commit()
+
+
+@when("supplier {supplier_id:d} is added for product {product_id:d} at unit cost {unit_cost:d}")
+def step_impl(ctx, supplier_id, product_id, unit_cost):
+    add_product_supplier(ctx, supplier_id, product_id, unit_cost)
+
+
+@then("product {product_id:d} should have {count:d} suppliers")
+def step_impl(ctx, product_id, count):
+    ctx.session.expire_all()
+    product = ctx.session.get(models.Product, product_id)
+    assert product.count_suppliers == count, product.count_suppliers
+
+
+@then("the product {product_id:d} supplier request should choose supplier {supplier_id:d}")
+def step_impl(ctx, product_id, supplier_id):
+    request = supplier_request(ctx, product_id)
+    assert request.chosen_supplier_id == supplier_id, request.chosen_supplier_id
+
+
+@when("the quantity of the product {product_id:d} item is changed to {quantity:d}")
+def step_impl(ctx, product_id, quantity):
+    order_item(ctx, product_id).quantity = quantity
+    ctx.session.commit()
+
+
+@when("the product {product_id:d} item is changed to product {new_product_id:d}")
+def step_impl(ctx, product_id, new_product_id):
+    order_item(ctx, product_id).product_id = new_product_id
+    ctx.session.commit()
+
+
+@given("a decision cache file")
+def step_impl(ctx):
+    path = os.path.join(ctx.scratch, 'ai_decisions.sqlite')
+    set_env(ctx, 'APILOGICSERVER_AI_CACHE_DB', path)
+    ctx.add_cleanup(lambda: ai_value_computation._decision_dbs.pop(path).close()
+                    if path in ai_value_computation._decision_dbs else None)
+
+
+@when("the in-memory AI decisions are forgotten")
+def step_impl(ctx):
+    ai_value_computation._ai_response_cache.clear()
+
+
+@given("the demo database with supplier selection logic declared twice")
+def step_impl(ctx):
+    activate_supplier_selection(ctx, declarations=2)
+
+
+@given('AI mode "{mode}"')
+def step_impl(ctx, mode):
+    set_env(ctx, 'APILOGICSERVER_AI_MODE', mode)
+
+
+@when("the background AI selections complete")
+def step_impl(ctx):
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        ctx.session.expire_all()
+        if not ctx.session.query(models.SysSupplierReq) \
+                .filter(models.SysSupplierReq.reason.startswith(ai_value_computation.BACKGROUND_PENDING)).count():
+            return
+        time.sleep(0.05)
+    assert False, 'background AI selections did not complete'
+
+
+@then("the customer balance should be {balance:d}")
+def step_impl(ctx, balance):
+    ctx.session.expire_all()
+    customer = ctx.session.get(models.Customer, 1)
+    assert customer.balance == balance, customer.balance
+
+
+@when("the AI batch is submitted and applied")
+def step_impl(ctx):
+    batch_id = ai_value_computation.submit_ai_batch(ctx.session, models.SysSupplierReq)
+    assert batch_id == 'batch_1', f'submitted: {batch_id}'
+    ai_value_computation.apply_ai_batch(ctx.session, models.SysSupplierReq, batch_id)
+
+
+@given('AI model "{model}"')
+def step_impl(ctx, model):
+    set_env(ctx, 'APILOGICSERVER_AI_MODEL', model)
+
+
+@then('the last OpenAI call should use model "{model}"')
+def step_impl(ctx, model):
+    assert FakeOpenAI.calls[-1][0] == model, FakeOpenAI.calls
+
+
+@then("{count:d} of the OpenAI calls should have been prefetched")
+def step_impl(ctx, count):
+    assert FakeOpenAI.prefetched_calls == count, (FakeOpenAI.prefetched_calls, FakeOpenAI.calls)
+
+
+@then('the product {product_id:d} supplier request should record world conditions "{world_conditions}"')
+def step_impl(ctx, product_id, world_conditions):
+    request = json.loads(supplier_request(ctx, product_id).request)
+    assert request['world_conditions'] == world_conditions, request
+
+
+@given("test context files are rechecked every {seconds:f} seconds")
+def step_impl(ctx, seconds):
+    ctx.add_cleanup(setattr, ai_value_computation, 'TEST_CONTEXT_RECHECK_SECONDS',
+                    ai_value_computation.TEST_CONTEXT_RECHECK_SECONDS)
+    ai_value_computation.TEST_CONTEXT_RECHECK_SECONDS = seconds
+
+
+@when('the test context file is changed to world conditions "{world_conditions}"')
+def step_impl(ctx, world_conditions):
+    write_test_context(ctx, os.path.basename(ctx.test_context_path), world_conditions)
+    time.sleep(2 * ai_value_computation.TEST_CONTEXT_RECHECK_SECONDS)
+
+
+@when("the test context file is removed")
+def step_impl(ctx):
+    os.remove(ctx.test_context_path)
+    time.sleep(2 * ai_value_computation.TEST_CONTEXT_RECHECK_SECONDS)
+
+
+@given("cached AI decisions are not audited again")
+def step_impl(ctx):
+    set_env(ctx, 'APILOGICSERVER_AI_AUDIT_CACHED', 'skip')
+
+
+@given('AI audit "{level}"')
+def step_impl(ctx, level):
+    set_env(ctx, 'APILOGICSERVER_AI_AUDIT', level)
+
+
+@then('the product {product_id:d} supplier request should record "{key}" in its request, not "{omitted_key}"')
+def step_impl(ctx, product_id, key, omitted_key):
+    request = json.loads(supplier_request(ctx, product_id).request)
+    assert key in request and omitted_key not in request, request
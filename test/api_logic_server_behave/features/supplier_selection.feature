@@ -0,0 +1,255 @@
+Feature: Supplier selection - AI choice, deterministic fallbacks and their audit
+
+  Scenario: A multi-product order selects its suppliers in one prefetched prompt
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that chooses the first candidate
+    And supplier 1 is added for product 1 at unit cost 140
+    And supplier 2 is added for product 1 at unit cost 120
+    When an order is placed with items "6:1, 1:2"
+    Then the product 6 item should have unit price 205
+    And the product 1 item should have unit price 140
+    And the order total should be 485
+    And there should be 2 new supplier requests
+    And OpenAI should have been called 1 times
+    And the last OpenAI call should select for 2 products
+
+  Scenario: A multi-product order prefetches with the caller's selection parameters
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that chooses the first candidate
+    And supplier selection optimized for "lowest cost"
+    And supplier 1 is added for product 1 at unit cost 140
+    And supplier 2 is added for product 1 at unit cost 120
+    When an order is placed with items "6:1, 1:2"
+    Then there should be 2 new supplier requests
+    And OpenAI should have been called 1 times
+    And the last OpenAI call should select for 2 products
+
+  Scenario: Product changes maintain the supplier count
+    Given the demo database with supplier selection logic
+    And no OpenAI API key
+    When product 6 is renamed
+    And supplier 1 is added for product 1 at unit cost 140
+    Then product 1 should have 1 suppliers
+    And product 6 should have 2 suppliers
+
+  Scenario: Without an API key, the cheapest supplier is chosen
+    Given the demo database with supplier selection logic
+    And no OpenAI API key
+    When an order is placed with items "6:1"
+    Then the product 6 item should have unit price 105
+    And the product 6 supplier request should have unit price 105 and reason "Fallback: No API key"
+
+  Scenario: Without an API key, equally cheap suppliers go to the first
+    Given the demo database with supplier selection logic
+    And no OpenAI API key
+    And supplier 2 is added for product 1 at unit cost 120
+    And supplier 1 is added for product 1 at unit cost 120
+    When an order is placed with items "1:1"
+    Then the product 1 item should have unit price 120
+    And the product 1 supplier request should choose supplier 2
+
+  Scenario: Without an API key, a lone supplier is the only candidate
+    Given the demo database with supplier selection logic
+    And no OpenAI API key
+    And supplier 2 is added for product 1 at unit cost 120
+    When an order is placed with items "1:1"
+    Then the product 1 item should have unit price 120
+    And the product 1 supplier request should have unit price 120 and reason "Deterministic short-circuit: only one candidate"
+
+  Scenario: A quantity change does not select the supplier again
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that chooses the first candidate
+    When an order is placed with items "6:1"
+    And the quantity of the product 6 item is changed to 3
+    Then the product 6 item should have unit price 205
+    And the order total should be 615
+    And there should be 1 new supplier requests
+    And OpenAI should have been called 1 times
+
+  Scenario: A product change selects the supplier again
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that chooses the first candidate
+    And supplier 1 is added for product 1 at unit cost 140
+    And supplier 2 is added for product 1 at unit cost 120
+    When an order is placed with items "1:1"
+    And the product 1 item is changed to product 6
+    Then the product 6 item should have unit price 205
+    And the order total should be 205
+    And there should be 2 new supplier requests
+    And OpenAI should have been called 2 times
+
+  Scenario: The decision cache file reuses a decision
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that chooses the first candidate
+    And a decision cache file
+    When an order is placed with items "6:1"
+    And the in-memory AI decisions are forgotten
+    And an order is placed with items "6:2"
+    Then the product 6 item should have unit price 205
+    And the product 6 supplier request should have unit price 205 and reason "cached: fake: first candidate"
+    And OpenAI should have been called 1 times
+
+  Scenario: Logic declared twice runs once
+    Given the demo database with supplier selection logic declared twice
+    And no OpenAI API key
+    When an order is placed with items "6:1"
+    Then the order total should be 105
+    And there should be 1 new supplier requests
+
+  Scenario: Background mode reprices the order with the AI selection after commit
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that chooses the first candidate
+    And AI mode "background"
+    When an order is placed with items "6:1"
+    And the background AI selections complete
+    Then the product 6 supplier request should have unit price 205 and reason "fake: first candidate"
+    And the product 6 item should have unit price 205
+    And the order total should be 205
+    And the customer balance should be 295
+    And OpenAI should have been called 1 times
+
+  Scenario: Background mode keeps the provisional price when the AI selection exceeds the credit limit
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that chooses the first candidate
+    And AI mode "background"
+    When an order is placed with items "6:24"
+    And the background AI selections complete
+    Then the product 6 supplier request should have unit price 105 and reason "AI background selection rejected"
+    And the product 6 item should have unit price 105
+    And the order total should be 2520
+    And the customer balance should be 2610
+
+  Scenario: Batch mode reprices the order with the AI selections from the Batch API
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that chooses the first candidate
+    And AI mode "batch"
+    When an order is placed with items "6:1"
+    Then the product 6 supplier request should have unit price 105 and reason "Pending AI batch"
+    And the product 6 item should have unit price 105
+    And OpenAI should have been called 0 times
+    When the AI batch is submitted and applied
+    Then the product 6 supplier request should have unit price 205 and reason "fake: first candidate"
+    And the product 6 item should have unit price 205
+    And the order total should be 205
+    And the customer balance should be 295
+
+  Scenario: Batch mode keeps the provisional price when an AI selection exceeds the credit limit
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that chooses the first candidate
+    And AI mode "batch"
+    When an order is placed with items "6:24"
+    And the AI batch is submitted and applied
+    Then the product 6 supplier request should have unit price 105 and reason "AI batch batch_1 selection rejected"
+    And the product 6 item should have unit price 105
+    And the customer balance should be 2610
+
+  Scenario: Under normal operations, a supplier cheaper and no slower is chosen without AI
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that chooses the first candidate
+    And a test context file "ai_test_context.yaml" with world conditions "normal operations"
+    And supplier 1 is added for product 1 at unit cost 140 and lead time 3 days
+    And supplier 2 is added for product 1 at unit cost 120 and lead time 3 days
+    When an order is placed with items "1:2"
+    Then the product 1 item should have unit price 120
+    And the product 1 supplier request should have unit price 120 and reason "Deterministic short-circuit: candidate dominates"
+    And OpenAI should have been called 0 times
+
+  Scenario: Under normal operations, suppliers tied on cost and lead time are left to AI
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that chooses the first candidate
+    And a test context file "ai_test_context.yaml" with world conditions "normal operations"
+    And supplier 1 is added for product 1 at unit cost 120 and lead time 3 days
+    And supplier 2 is added for product 1 at unit cost 120 and lead time 3 days
+    When an order is placed with items "1:2"
+    Then the product 1 supplier request should have unit price 120 and reason "fake: first candidate"
+    And OpenAI should have been called 1 times
+
+  Scenario: A selection among a few suppliers uses the small model
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that chooses the first candidate
+    When an order is placed with items "6:1"
+    Then OpenAI should have been called 1 times
+    And the last OpenAI call should use model "gpt-4o-mini"
+
+  Scenario: An explicitly configured model is used for every selection
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that chooses the first candidate
+    And AI model "gpt-4.1"
+    When an order is placed with items "6:1"
+    Then OpenAI should have been called 1 times
+    And the last OpenAI call should use model "gpt-4.1"
+
+  Scenario: A selection omitted from a batch response is retried in the prefetch
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that omits the last selection of each batch prompt
+    And supplier 1 is added for product 1 at unit cost 140
+    And supplier 2 is added for product 1 at unit cost 120
+    When an order is placed with items "6:1, 1:2"
+    Then the product 6 item should have unit price 205
+    And the product 1 item should have unit price 140
+    And OpenAI should have been called 2 times
+    And 2 of the OpenAI calls should have been prefetched
+    And the last OpenAI call should select for 1 products
+
+  Scenario: A refused selection falls back to the cheapest supplier
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that refuses to choose
+    When an order is placed with items "6:1"
+    Then OpenAI should have been called 1 times
+    And the product 6 item should have unit price 105
+    And the product 6 supplier request should have unit price 105 and reason "Fallback:"
+
+  Scenario: A selection out of range falls back to the cheapest supplier
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that chooses an index out of range
+    When an order is placed with items "6:1"
+    Then OpenAI should have been called 1 times
+    And the product 6 item should have unit price 105
+    And the product 6 supplier request should have unit price 105 and reason "Fallback:"
+
+  Scenario: World conditions are read from a TOML test context, relative to the project root
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that chooses the first candidate
+    And a test context file "ai_test_context.toml" with world conditions "hurricane in Gulf of Mexico", given by its path relative to the project root
+    When an order is placed with items "6:1"
+    Then the product 6 supplier request should record world conditions "hurricane in Gulf of Mexico"
+    And OpenAI should have been called 1 times
+
+  Scenario: A test context file is reloaded when changed, and normal operations apply once it is removed
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that chooses the first candidate
+    And test context files are rechecked every 0.05 seconds
+    And a test context file "ai_test_context.yaml" with world conditions "hurricane in Gulf of Mexico"
+    When an order is placed with items "6:1"
+    Then the product 6 supplier request should record world conditions "hurricane in Gulf of Mexico"
+    When the test context file is changed to world conditions "port strike"
+    And an order is placed with items "6:1"
+    Then the product 6 supplier request should record world conditions "port strike"
+    When the test context file is removed
+    And an order is placed with items "6:1"
+    Then the product 6 supplier request should have unit price 105 and reason "Deterministic short-circuit: candidate dominates"
+
+  Scenario: A repeated cached decision prices the Item without another supplier request
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that chooses the first candidate
+    And cached AI decisions are not audited again
+    When an order is placed with items "6:1"
+    And an order is placed with items "6:2"
+    Then the product 6 item should have unit price 205
+    And the order total should be 410
+    And there should be 1 new supplier requests
+    And OpenAI should have been called 1 times
+
+  Scenario: A summary audit records the number of candidates, not the candidates
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that chooses the first candidate
+    And AI audit "summary"
+    When an order is placed with items "6:1"
+    Then the product 6 supplier request should have unit price 205 and reason "fake: first candidate"
+    And the product 6 supplier request should record "candidate_count" in its request, not "candidates"
+
+  Scenario: By default, the audit records the candidates
+    Given the demo database with supplier selection logic
+    And a fake OpenAI client that chooses the first candidate
+    When an order is placed with items "6:1"
+    Then the product 6 supplier request should record "candidates" in its request, not "candidate_count"